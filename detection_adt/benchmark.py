@@ -0,0 +1,184 @@
+"""
+    Benchmarks of the hot paths of detection.py on synthetic datasets.
+
+    Each stage is timed (best of `--repeat` runs) and then run once more under tracemalloc
+    to record its peak memory. Results are printed or written as JSON so runs can be compared:
+
+        python benchmark.py --frames 1000 --boxes 50 --output before.json
+"""
+from detection import BoundingBox, BoundingBoxArray, Detection
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+def synthetic_boxes(num_frames=100, boxes_per_frame=20, num_labels=3, density=0.5, box_size=50, seed=0):
+    """
+        Returns (frame_ids, labels, coords) arrays of random boxes.
+
+        Parameters
+        ----------
+        num_frames : int ::
+            the number of frames
+        boxes_per_frame : int ::
+            the number of boxes in each frame
+        num_labels : int ::
+            the number of distinct labels, named 'label_0', 'label_1', ...
+        density : float ::
+            the expected fraction of a frame covered by boxes, so higher densities overlap more.
+            Frames are square and sized to reach this density
+        box_size : int ::
+            the mean width and height of a box
+        seed : int ::
+            the seed of the generator
+    """
+    rng = np.random.default_rng(seed)
+    n = num_frames * boxes_per_frame
+
+    frame_size = box_size * np.sqrt(boxes_per_frame / density)
+
+    sizes = rng.uniform(0.5, 1.5, (n, 2)) * box_size
+    top_left = rng.uniform(0, 1, (n, 2)) * np.maximum(frame_size - sizes, 0)
+
+    frame_ids = np.repeat(np.arange(num_frames), boxes_per_frame)
+    labels = np.array(['label_{}'.format(i) for i in range(num_labels)])[rng.integers(0, num_labels, n)]
+    coords = np.round(np.concatenate([top_left, top_left + sizes], axis=1), 1)
+
+    return frame_ids, labels, coords
+
+def synthetic_predictions(frame_ids, labels, coords, jitter=0.1, false_positive_rate=0.2, seed=1):
+    """
+        Returns (frame_ids, labels, coords, confidences) arrays of predictions of the boxes: every box
+        moved by up to `jitter` of its size, plus a `false_positive_rate` fraction of boxes shifted far away.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = np.tile(coords[:, 2:] - coords[:, :2], 2)
+
+    preds = coords + rng.uniform(-jitter, jitter, coords.shape) * sizes
+    preds[:, 2:] = np.maximum(preds[:, 2:], preds[:, :2] + 1)
+
+    fp = rng.random(len(coords)) < false_positive_rate
+    shifted = coords[fp] + np.tile(sizes[fp, :2] * 2, 2)
+
+    return (np.concatenate([frame_ids, frame_ids[fp]]), np.concatenate([labels, labels[fp]]),
+        np.round(np.concatenate([preds, shifted]), 1), np.round(rng.random(len(coords) + int(fp.sum())), 3))
+
+def write_csv(filepath, frame_ids, labels, coords, confidences=None):
+    """Writes boxes in the `Detection.from_csv` format."""
+    columns = [frame_ids.astype(str), labels.astype(str)] + [coords[:, i].astype(str) for i in range(4)]
+
+    if confidences is not None:
+        columns.append(confidences.astype(str))
+
+    with open(filepath, 'w') as f:
+        f.write('\n'.join(', '.join(row) for row in zip(*columns)) + '\n')
+
+def measure(func, repeat=3):
+    """Returns (seconds, peak_bytes): the best time of `repeat` calls of `func` and the peak memory of one more call."""
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak
+
+def stages(args, tmp_dir):
+    """Returns a dict of stage name -> function to benchmark, sharing one synthetic dataset."""
+    labels = synthetic_boxes(args.frames, args.boxes, args.labels, args.density, seed=args.seed)
+    predictions = synthetic_predictions(*labels, seed=args.seed + 1)
+
+    label_csv = os.path.join(tmp_dir, 'labels.csv')
+    pred_csv = os.path.join(tmp_dir, 'preds.csv')
+    write_csv(label_csv, *labels)
+    write_csv(pred_csv, *predictions)
+
+    label_rows = list(zip(*[array.tolist() for array in labels]))
+    det = Detection(columnar=args.columnar)
+    det.from_csv(label_filepath=label_csv, pred_filepath=pred_csv)
+
+    boxes = [BoundingBox(frame, label, coords[:2], coords[2:]) for frame,label,coords in label_rows[:1000]]
+
+    def add_label():
+        new = Detection(columnar=args.columnar)
+
+        for frame,label,coords in label_rows:
+            new.add_label(frame, label, coords[:2], coords[2:])
+
+    def digest_csv():
+        Detection(columnar=args.columnar).from_csv(label_filepath=label_csv, pred_filepath=pred_csv)
+
+    def bounding_box_iou():
+        for a in boxes[:200]:
+            for b in boxes[:200]:
+                a.iou(b)
+
+    def add_disjoint_boxes():
+        frame_size = int(np.ceil(labels[2][:, 2:].max()))
+
+        for frame in list(det.labels)[:100]:
+            BoundingBoxArray(det.labels[frame], max_width=frame_size, max_height=frame_size).add_disjoint_boxes(args.boxes, min_width=5, min_height=5)
+
+    return {
+        'add_label': add_label,
+        'digest_csv': digest_csv,
+        'bounding_box_iou': bounding_box_iou,
+        'metrics': lambda: det.metrics(),
+        'metrics_greedy': lambda: det.metrics(matching='greedy'),
+        'average_precision': lambda: det.average_precision(),
+        'add_disjoint_boxes': add_disjoint_boxes,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark detection.py on a synthetic dataset.')
+    parser.add_argument('--frames', type=int, default=200, help='number of frames')
+    parser.add_argument('--boxes', type=int, default=20, help='labels per frame')
+    parser.add_argument('--labels', type=int, default=3, help='number of distinct labels')
+    parser.add_argument('--density', type=float, default=0.5, help='fraction of a frame covered by boxes')
+    parser.add_argument('--columnar', action='store_true', help='use columnar storage')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best is kept')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic dataset')
+    parser.add_argument('--stages', nargs='*', help='stages to run, all by default')
+    parser.add_argument('--output', help='write JSON results to this file instead of printing them')
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        funcs = stages(args, tmp_dir)
+
+        for name in args.stages or funcs:
+            if name not in funcs:
+                raise RuntimeError('Unknown stage {}, expected one of {}!'.format(name, ', '.join(funcs)))
+
+            seconds, peak = measure(funcs[name], args.repeat)
+            results.append({'stage': name, 'seconds': seconds, 'peak_bytes': peak})
+
+    report = {
+        'params': vars(args),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,26 @@
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from operator import attrgetter
 import numpy as np
+import hashlib
+import json
+import os
 import random
+import shutil
+import tempfile
+import weakref
+import zlib
 
 class BoundingBox():
     """
         A Bounding Box for a particular frame.
+
+        Bounding boxes are immutable and hashable. Coordinates are stored once as floats,
+        and `top_left`, `bottom_right`, `width` and `height` are derived from them.
     """
 
+    __slots__ = ['_frame_id', '_label', '_tlx', '_tly', '_brx', '_bry', '_confidence', '_area']
+
     def __init__(self, frame_id, object_label, top_left, bottom_right, confidence=None):
         """
             Parameters
@@ -23,17 +37,43 @@ class BoundingBox():
                 the confidence that this bounding box is correct
         """
 
-        self.frame_id = frame_id
-        self.label = object_label
-        self.top_left = top_left
-        self.tlx,self.tly = [float(x) for x in self.top_left]
-        self.bottom_right = bottom_right
-        self.brx,self.bry = [float(x) for x in self.bottom_right]
-
-        self.width = self.brx - self.tlx
-        self.height = self.bry - self.tly
-        
-        self.confidence = confidence
+        tlx,tly = top_left
+        brx,bry = bottom_right
+
+        self._frame_id = frame_id
+        self._label = object_label
+        self._tlx = tlx = float(tlx)
+        self._tly = tly = float(tly)
+        self._brx = brx = float(brx)
+        self._bry = bry = float(bry)
+        self._confidence = confidence
+        self._area = (brx - tlx) * (bry - tly)
+
+    # read-only views of the slots, which keep BoundingBox immutable
+    frame_id = property(attrgetter('_frame_id'))
+    label = property(attrgetter('_label'))
+    tlx = property(attrgetter('_tlx'))
+    tly = property(attrgetter('_tly'))
+    brx = property(attrgetter('_brx'))
+    bry = property(attrgetter('_bry'))
+    confidence = property(attrgetter('_confidence'))
+    area = property(attrgetter('_area'))
+
+    @property
+    def top_left(self):
+        return self._tlx, self._tly
+
+    @property
+    def bottom_right(self):
+        return self._brx, self._bry
+
+    @property
+    def width(self):
+        return self._brx - self._tlx
+
+    @property
+    def height(self):
+        return self._bry - self._tly
 
     def related_to(self, other_bounding_box):
         """
@@ -94,7 +134,7 @@ class BoundingBox():
         """Calculates the union area of this bounding box and another bounding box."""
         obb = other_bounding_box
 
-        total_area = self.width * self.height + obb.width * obb.height
+        total_area = self.area + obb.area
 
         return total_area - self._intersection(obb)
 
@@ -115,464 +155,2402 @@ class BoundingBox():
         return list_to_ret
     
     def __eq__(self, value):
-        return type(value) == BoundingBox and \
-            self.frame_id == value.frame_id and \
-            self.label == value.label and \
-            self.bottom_right == value.bottom_right and \
-            self.top_left == value.top_left and \
-            self.confidence == value.confidence
+        if not isinstance(value, BoundingBox): return False
 
-class Detection():
+        return self._tlx == value._tlx and self._tly == value._tly and \
+            self._brx == value._brx and self._bry == value._bry and \
+            self._label == value._label and \
+            self._frame_id == value._frame_id and \
+            self._confidence == value._confidence
+
+    def __hash__(self):
+        return hash((self._frame_id, self._label, self._tlx, self._tly, self._brx, self._bry, self._confidence))
+
+def pairwise_iou(boxes_a, boxes_b):
     """
-        An abstract Detection encompassing any number of frames,
-        absolute labels, and/or predictions.
+        Calculates the intersection over union of every box in `boxes_a` against every box in `boxes_b`.
+
+        Parameters
+        ----------
+        boxes_a : ndarray (N, 4) :
+            rows of (top_left_x, top_left_y, bottom_right_x, bottom_right_y)
+        boxes_b : ndarray (M, 4) :
+            rows of (top_left_x, top_left_y, bottom_right_x, bottom_right_y)
+
+        Returns
+        -------
+        an (N, M) ndarray of floats where item [i, j] is the IoU of `boxes_a[i]` and `boxes_b[j]`
     """
+    return _iou(boxes_a[:, None, :], boxes_b[None, :, :])
 
-    def __init__(self, labels=None, predictions=None, frames=None):
-        """
-            Initialize this `Detection` object.
+def _iou(a, b):
+    """The IoU of boxes `a` and `b`, broadcast over all but their last axis."""
+    inter_w = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    inter_h = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    intersection = np.where((inter_w < 0) | (inter_h < 0), 0.0, inter_w * inter_h)
 
-            Paramters
-            ---------
-            labels : iterable of
-            
-            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y))` 
-            
-            or
-            
-            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), confidence)`
-            
-            or
-            
-            `BoundingBox`::
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
 
-            All of the ground-truth labels for a given set of frames.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return intersection / (area_a + area_b - intersection)
 
-            predictions : iterable of
+def related_iou(pred_boxes, pred_labels, label_boxes, label_labels):
+    """
+        Calculates the IoU of every prediction and label of a frame that are related (see
+        `BoundingBox.related_to`), so that matches at any IoU threshold can be derived from one computation.
 
-            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y))` 
-            
-            or
-            
-            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), confidence)`
-            
-            or
-            
-            `BoundingBox`::
+        Parameters
+        ----------
+        See `match_matrix`.
 
-            All of the predictions for a given set of frames.
+        Returns
+        -------
+        a (P, L) ndarray of floats holding the IoU of related pairs and -inf for all other pairs
+    """
+    p = pred_boxes[:, None, :]
+    l = label_boxes[None, :, :]
 
-            TODO frames : iterable of `Frame` or `channels`x`rows`x`columns` numpy array
-        """
+    overlap = (p[..., 0] <= l[..., 2]) & (p[..., 2] >= l[..., 0]) & \
+        (p[..., 1] <= l[..., 3]) & (p[..., 3] >= l[..., 1])
+    related = (pred_labels[:, None] == label_labels[None, :]) & overlap
 
-        if labels != None:
-            self.labels = self._handle_new_bounding_boxes(labels)
-        else:
-            self.labels = None
+    return np.where(related, pairwise_iou(pred_boxes, label_boxes), -np.inf)
 
-        if predictions != None:
-            self.predictions = self._handle_new_bounding_boxes(predictions)
-        else:
-            self.predictions = None
+def match_matrix(pred_boxes, pred_labels, label_boxes, label_labels, iou_threshold=0.5):
+    """
+        The batched equivalent of calling `BoundingBox.matches` for every prediction in a frame.
+
+        Parameters
+        ----------
+        pred_boxes : ndarray (P, 4) :
+            the predicted boxes of a frame
+        pred_labels : ndarray (P,) :
+            the labels (or integer label codes) of the predicted boxes
+        label_boxes : ndarray (L, 4) :
+            the ground-truth boxes of the same frame
+        label_labels : ndarray (L,) :
+            the labels (or integer label codes) of the ground-truth boxes
+        iou_threshold : float :
+            the threshold for overlapping bounding boxes to determine a valid match
+
+        Returns
+        -------
+        a (P, L) boolean ndarray where item [i, j] is True if prediction i matches label j
+    """
+    return related_iou(pred_boxes, pred_labels, label_boxes, label_labels) >= iou_threshold
 
-        if frames != None:
-            pass # TODO
+# frames with more prediction x label pairs than this are matched through a `LabelIndex`
+_DENSE_PAIR_LIMIT = 4096
 
-    def _handle_new_bounding_boxes(self, bb_iter):
-        """
-            Converts all possible bounding-box array formats into one format.
+class LabelIndex():
+    """
+        A sort-and-sweep index over the x intervals of the labels of one frame, keyed by label,
+        so that matching only visits labels that overlap a prediction.
+    """
 
+    def __init__(self, label_boxes, label_labels):
+        """
             Parameters
             ----------
-            bb_array : iterable of bounding boxes in the format described in
-            `__init__`
+            label_boxes : ndarray (L, 4) :
+                the ground-truth boxes of a frame
+            label_labels : ndarray (L,) :
+                the labels (or integer label codes) of the ground-truth boxes
         """
+        self.boxes = np.asarray(label_boxes)
+        self.groups = dict()
 
-        # (frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), confidence)
+        label_labels = np.asarray(label_labels)
 
-        dict_to_ret = dict()
+        for label in np.unique(label_labels):
+            order = np.flatnonzero(label_labels == label)
+            order = order[np.argsort(self.boxes[order, 0], kind='stable')]
 
-        for item in bb_iter:
-            if type(item) == BoundingBox:
-                if item.frame_id not in dict_to_ret:
-                    dict_to_ret[item.frame_id] = list()
+            # labels before the first running max of brx >= a prediction's tlx cannot reach it
+            tlx = self.boxes[order, 0]
+            max_brx = np.maximum.accumulate(self.boxes[order, 2])
 
-                dict_to_ret[item.frame_id].append(item)
-            else:
-                pass # TODO
-        
-        return dict_to_ret
+            self.groups[label] = order, tlx, max_brx
 
-    def from_csv(self, label_filepath=None, pred_filepath=None, delimiter=',', line_delimiter='\n'):
+    def candidates(self, pred_boxes, pred_labels):
         """
-            Loads the data from the specified filepath(s) and formats them appropriately.
+            Returns (pred_idx, label_idx), the indices of every related (same label and overlapping)
+            prediction and label pair.
+        """
+        pred_parts, label_parts = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
 
-            The CSV must be formatted as follows:
+        pred_labels = np.asarray(pred_labels)
 
-            frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y
+        for label in np.unique(pred_labels):
+            if label not in self.groups: continue
 
-            or 
+            order, tlx, max_brx = self.groups[label]
+            preds = np.flatnonzero(pred_labels == label)
 
-            frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y, confidence
+            lo = np.searchsorted(max_brx, pred_boxes[preds, 0], side='left')
+            hi = np.searchsorted(tlx, pred_boxes[preds, 2], side='right')
+            counts = np.maximum(hi - lo, 0)
 
-            Parameters
-            ----------
-            label_filepath : str ::
-                the relative filepath to the csv file containing the ground truth labels
+            # position t of the flattened windows is label lo + t - (start of its window)
+            shift = np.repeat(lo - np.cumsum(counts) + counts, counts)
 
-            pred_filepath : str ::
-                the relative filepath to the csv file containing the predicted labels
+            pred_parts.append(np.repeat(preds, counts))
+            label_parts.append(order[np.arange(counts.sum()) + shift])
 
-            delimiter : str ::
-                the delimiting character or str between entries in a row
+        pred_idx = np.concatenate(pred_parts)
+        label_idx = np.concatenate(label_parts)
 
-            line_delimiter : str ::
-                the delimiting character or str between rows
+        p = pred_boxes[pred_idx]
+        l = self.boxes[label_idx]
 
-            Returns
-            -------
-            None
-        """
+        overlap = (p[:, 1] <= l[:, 3]) & (p[:, 3] >= l[:, 1]) & (p[:, 0] <= l[:, 2]) & (p[:, 2] >= l[:, 0])
 
-        if label_filepath != None:
-            self.labels = self._digest_csv(label_filepath, delimiter, line_delimiter)
-        
-        if pred_filepath != None:
-            self.predictions = self._digest_csv(pred_filepath, delimiter, line_delimiter)
+        return pred_idx[overlap], label_idx[overlap]
 
-    def _digest_csv(self, filepath, delimiter, line_delimiter):
-        """Digest a csv file into a dictionary where frames are keys and lists of BoundingBox are values"""
+def related_pairs(pred_boxes, pred_labels, label_boxes, label_labels, index=None):
+    """
+        The sparse equivalent of `related_iou`: the IoU of only the related prediction and label pairs.
 
-        dict_to_ret = dict()
+        Small frames are computed densely, and large ones through `index` (a `LabelIndex` of the labels),
+        which is built on the fly if not given.
 
-        with open(filepath) as f:
-            lines = f.read()
+        Returns
+        -------
+        a tuple of (pred_idx, label_idx, ious) arrays, one item per related pair
+    """
+    if index is None and len(pred_boxes) * len(label_boxes) <= _DENSE_PAIR_LIMIT:
+        ious = related_iou(pred_boxes, pred_labels, label_boxes, label_labels)
+        pred_idx, label_idx = np.nonzero(ious > -np.inf)
 
-        for line in lines.split(line_delimiter):
-            splt = [item.strip() for item in line.split(delimiter)]
+        return pred_idx, label_idx, ious[pred_idx, label_idx]
 
-            if len(splt) <= 1: continue
+    if index is None:
+        index = LabelIndex(label_boxes, label_labels)
 
-            if len(splt) == 6:
-                frame_id,label,tlx,tly,brx,bry = splt
-                confidence = None
-            elif len(splt) == 7:
-                frame_id,label,tlx,tly,brx,bry,confidence= splt
-            else:
-                raise RuntimeError('Incorrect CSV row format!')
+    pred_idx, label_idx = index.candidates(pred_boxes, pred_labels)
 
-            if frame_id in dict_to_ret:
-                dict_to_ret[frame_id].append(BoundingBox(frame_id, label, (tlx,tly), (brx,bry), confidence=confidence))
-            else:
-                dict_to_ret[frame_id] = [BoundingBox(frame_id, label, (tlx,tly), (brx,bry), confidence=confidence)]
-                    
-        return dict_to_ret
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ious = _iou(pred_boxes[pred_idx], index.boxes[label_idx])
 
-    def add_label(self, *args):
-        """
-            Add a prediction of the form BoundingBox or
+    # a zero union never matches, as in `related_iou`
+    valid = ~np.isnan(ious)
 
-            `frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y(, confidence)`
+    return pred_idx[valid], label_idx[valid], ious[valid]
 
-            where confidence is optional
-        """
-        try:
-            if self.labels == None: self.labels = dict()
+_get_coords = attrgetter('_tlx', '_tly', '_brx', '_bry')
+_get_label = attrgetter('_label')
+_get_confidence = attrgetter('_confidence')
 
-            self._add_bounding_box(args, self.labels)
-        except Exception as e:
-            self.labels = None
-            raise e
+def _boxes_to_arrays(bb_list, vocab):
+    """
+        Converts a list of BoundingBox into (coordinates, label codes, confidences) arrays.
 
-    def add_prediction(self, *args):
-        """
-            Add a prediction of the form BoundingBox or
+        Labels are interned into `vocab` so that codes are comparable across calls sharing it,
+        and a confidence of None becomes NaN.
+    """
+    coords = np.array(list(map(_get_coords, bb_list)), dtype=np.float64).reshape(-1, 4)
+    codes = np.array([vocab.setdefault(label, len(vocab)) for label in map(_get_label, bb_list)], dtype=np.int64)
+    confidences = np.array([np.nan if c is None else float(c) for c in map(_get_confidence, bb_list)], dtype=np.float64)
 
-            `frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y{, confidence}` or
+    return coords, codes, confidences
 
-            `frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y){, confidence}`
+def _frame_reader(store, vocab):
+    """
+        Returns a function of frame_id -> (coordinates, label codes, confidences) over a
+        labels/predictions store, which is either a dict of lists of BoundingBox or a `BoundingBoxColumns`.
+    """
+    if isinstance(store, BoundingBoxColumns):
+        remap = np.array([vocab.setdefault(name, len(vocab)) for name in store.label_names], dtype=np.int64)
 
-            where confidence is optional
-        """
+        def read(frame):
+            coords, codes, confidences = store.frame_arrays(frame)
+            return coords, remap[codes], confidences
+
+        return read
+
+    return lambda frame: _boxes_to_arrays(store[frame], vocab)
+
+PRCurve = namedtuple('PRCurve', ['thresholds', 'precision', 'recall', 'fscore'])
+PRCurve.__doc__ = """
+    A precision/recall curve, where item i of each array is what `Detection.metrics` returns
+    with `confidence_threshold=thresholds[i]`. Thresholds are in descending order.
+"""
+
+MatchRecords = namedtuple('MatchRecords', ['pred_conf', 'pred_tp', 'pred_labels', 'label_conf', 'label_labels', 'label_names'])
+MatchRecords.__doc__ = """
+    The confidence-independent outcome of matching every prediction against the labels of its frame.
+
+    pred_conf : the confidence of each prediction, where a missing confidence is +inf
+    pred_tp : whether each prediction matches any label
+    pred_labels : the label code of each prediction
+    label_conf : the highest confidence of a prediction matching each label, or -inf
+    label_labels : the label code of each label
+    label_names : label code -> label
+"""
+
+MetricsGrid = namedtuple('MetricsGrid', ['iou_thresholds', 'confidence_thresholds', 'precision', 'recall', 'fscore'])
+MetricsGrid.__doc__ = """
+    Metrics over a grid of thresholds, where item [i, j] of each array is what `Detection.metrics`
+    returns with `iou_threshold=iou_thresholds[i]` and `confidence_threshold=confidence_thresholds[j]`.
+"""
+
+MATCHING = ['any', 'greedy', 'hungarian']
+
+def one_to_one(pred_conf, pairs, num_labels, iou_threshold=0.5, matching='greedy'):
+    """
+        Assigns each prediction of a frame to at most one label and each label to at most one prediction.
+
+        Parameters
+        ----------
+        pred_conf : ndarray (P,) :
+            the confidence of each prediction, where NaN or +inf means no confidence (always first)
+        pairs : tuple of ndarray :
+            the (pred_idx, label_idx, ious) of the frame as returned by `related_pairs`
+        num_labels : int :
+            the number of labels in the frame
+        iou_threshold : float :
+            the threshold for overlapping bounding boxes to determine a valid match
+        matching : str :
+            'greedy' visits predictions from most to least confident, each taking the unassigned
+            label it overlaps most. 'hungarian' finds the assignment with the most matches, and
+            then the highest total IoU, which requires scipy.
+
+        Returns
+        -------
+        a tuple of (pred_idx, label_idx) arrays of the assigned pairs
+    """
+    pred_idx, label_idx, ious = pairs
+
+    hit = ious >= iou_threshold
+    pred_idx, label_idx, ious = pred_idx[hit], label_idx[hit], ious[hit]
+
+    if matching == 'hungarian':
         try:
-            if self.predictions == None: self.predictions = dict()
-            self._add_bounding_box(args, self.predictions)
-        except Exception as e:
-            self.predictions = None
-            raise e
-    
-    def _add_bounding_box(self, bb_args, bb_dict):
-        """Add a bounding box to the specified label/predictions dict"""
-        bb = self._handle_bb_args(bb_args)
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            raise RuntimeError('Hungarian matching requires scipy!')
 
-        if bb.frame_id not in bb_dict:
-            bb_dict[bb.frame_id] = [bb]
-        else:
-            bb_dict[bb.frame_id].append(bb)
+        if len(ious) == 0:
+            return pred_idx, label_idx
 
-    def _handle_bb_args(self, args):
-        """Convert the arglist in any format to a BoundingBox and return it"""
-        if len(args) == 1: # BoundingBox
-            if type(args[0]) == BoundingBox:
-                return args[0]
-        elif len(args) in [4,5]: # frame_id, object_label, top_left, bottom_right(, confidence)
-            return BoundingBox(*args)
-        elif len(args) == 6:
-            return BoundingBox(*args[:2], (args[2], args[3]), (args[4], args[5]))
-        elif len(args) == 7:
-            return BoundingBox(*args[:2], (args[2], args[3]), (args[4], args[5]), args[6])
-        else:
-            raise RuntimeError('Unable to process BoundingBox arguments!')
+        # every match outweighs any total IoU, so the number of matches is maximized first
+        weights = np.zeros((len(pred_conf), num_labels))
+        weights[pred_idx, label_idx] = min(len(pred_conf), num_labels) + 1 + ious
 
-    def metrics(self, confidence_threshold=0.5, iou_threshold=0.5):
-        """
-            Parameters
-            ----------
-            confidence_threshold : float ::
-                the threshold under which predicted bounding boxes will be filtered out, as if they were not predicted at all
-            iou_threshold : float ::
-                the threshold for overlapping bounding boxes to determine a valid match
+        rows, cols = linear_sum_assignment(weights, maximize=True)
+        assigned = weights[rows, cols] > 0
 
-            Returns
-            -------
-            a tuple of floats for precision,recall,fscore
-        """
-        if self.labels == None:
-            raise RuntimeError('There are no labels associated with this detection!')
-        if self.predictions == None:
-            raise RuntimeError('There are no predictions associated with this detection!')
+        return rows[assigned], cols[assigned]
 
-        true_pos = 0
-        false_pos = 0
+    if matching != 'greedy':
+        raise RuntimeError('Unknown matching {}!'.format(matching))
 
-        # true_neg = 0 # irrelevant
-        false_neg = 0
+    conf = np.where(np.isnan(pred_conf), np.inf, pred_conf)
+    rank = np.empty(len(conf), dtype=np.int64)
+    rank[np.argsort(-conf, kind='stable')] = np.arange(len(conf))
 
-        for frame in self.labels:
-            labels = self.labels[frame]
+    # visit the pairs by prediction rank and then by decreasing IoU
+    order = np.lexsort((label_idx, -ious, rank[pred_idx]))
 
-            if frame not in self.predictions:
-                false_neg += len(labels)
-                continue
-            
-            preds = self.predictions[frame]
+    pred_taken = bytearray(len(pred_conf))
+    label_taken = bytearray(num_labels)
+    assigned_preds, assigned_labels = [], []
 
-            f_neg = [False for item in labels]
-            t_pos = []
-            
-            for pred in preds:
-                if pred.confidence == None or pred.confidence >= confidence_threshold:
-                    matches = pred.matches(labels, threshold=iou_threshold)
-                    t_pos.append(True in matches)
+    for p,l in zip(pred_idx[order].tolist(), label_idx[order].tolist()):
+        if pred_taken[p] or label_taken[l]: continue
 
-                    f_neg = [f_n or matches[i] for i,f_n in enumerate(f_neg)]
-            
-            for item in f_neg:
-                if item == False: false_neg += 1
-            
-            for item in t_pos:
-                if item == True: true_pos += 1
-                else: false_pos += 1
+        pred_taken[p] = label_taken[l] = 1
+        assigned_preds.append(p)
+        assigned_labels.append(l)
 
-        if true_pos == 0.0: # we made no good predictions. sad!
-            return 0.0,0.0,0.0
+    return np.array(assigned_preds, dtype=np.int64), np.array(assigned_labels, dtype=np.int64)
 
-        precision = true_pos / (true_pos + false_pos)
-        recall = true_pos / (true_pos + false_neg)
-        fscore = 2 * ( (precision * recall) / (precision + recall))
+def _frame_records(pred_conf, pairs, num_labels, iou_thresholds, matching='any'):
+    """
+        Matches all predictions of a frame, regardless of confidence, at each of the (I,) `iou_thresholds`
+        given the `related_pairs` of the frame.
 
-        return precision,recall,fscore
+        Returns (I, P) pred_tp and (I, L) label_conf as described in `MatchRecords`.
+    """
+    if matching != 'any':
+        if matching != 'greedy':
+            # greedy assignments of the predictions above a threshold never depend on those below it,
+            # which is what lets one pass serve every confidence threshold
+            raise RuntimeError('Only greedy one-to-one matching can be evaluated over confidence thresholds!')
 
-    def load_labels_from_annot_dict(self, annot_dict):
-        """
-            Only for use with annotation dict of form:
-            {
-            'frame_id': {
-                'label': [
-                    (x,y,w,h)
-                    ]
-                }
-            }
-        """
+        pred_tp = np.zeros((len(iou_thresholds), len(pred_conf)), dtype=bool)
+        label_conf = np.full((len(iou_thresholds), num_labels), -np.inf)
 
-        internal_dict = dict()
+        for i,iou_threshold in enumerate(iou_thresholds):
+            assigned_preds, assigned_labels = one_to_one(pred_conf, pairs, num_labels, iou_threshold, matching)
 
-        for frame in annot_dict:
-            if frame not in internal_dict:
-                internal_dict[frame] = []
+            pred_tp[i, assigned_preds] = True
+            label_conf[i, assigned_labels] = pred_conf[assigned_preds]
 
-            for label in annot_dict[frame]:
-                for box in annot_dict[frame][label]:
-                    x,y,w,h = box
+        return pred_tp, label_conf
 
-                    tlx = x
-                    tly = y
-                    brx = x + w
-                    bry = y + h
+    pred_idx, label_idx, ious = pairs
 
-                    bb = BoundingBox(frame, label, (tlx,tly), (brx,bry))
+    thresholds, pair = np.nonzero(ious[None, :] >= iou_thresholds[:, None])
 
-                    internal_dict[frame].append(bb)
+    pred_tp = np.zeros((len(iou_thresholds), len(pred_conf)), dtype=bool)
+    pred_tp[thresholds, pred_idx[pair]] = True
 
-        self.labels = internal_dict
+    label_conf = np.full((len(iou_thresholds), num_labels), -np.inf)
+    np.maximum.at(label_conf, (thresholds, label_idx[pair]), pred_conf[pred_idx[pair]])
 
-    def labels_to_annot_dict(self):
-        annot_dict = dict()
+    return pred_tp, label_conf
 
-        for frame in self.labels:
+def _counts_at(pred_conf, pred_tp, label_conf, thresholds):
+    """Returns the true positive, false positive and false negative counts at each confidence threshold."""
+    order = np.argsort(pred_conf, kind='stable')
+    conf = pred_conf[order]
+    tp_below = np.concatenate([[0], np.cumsum(pred_tp[order])])
 
-            if frame not in annot_dict:
-                annot_dict[frame] = dict()
+    # predictions at or above a threshold are the ones after its insertion point
+    below = np.searchsorted(conf, thresholds, side='left')
+    kept = len(conf) - below
 
-            for bb in self.labels[frame]:
-                if bb.label not in annot_dict[frame]:
-                    annot_dict[frame][bb.label] = []
+    true_pos = tp_below[-1] - tp_below[below]
+    false_pos = kept - true_pos
+    false_neg = np.searchsorted(np.sort(label_conf), thresholds, side='left')
 
-                val = bb.tlx, bb.tly, bb.brx - bb.tlx, bb.bry - bb.tly
-                annot_dict[frame][bb.label].append(val)
+    return true_pos, false_pos, false_neg
 
-        return annot_dict
+def _histogram(values, *weights):
+    """Returns the sorted distinct `values` and the sum of each of `weights` at every one of them."""
+    unique, inverse = np.unique(values, return_inverse=True)
 
-    def add_disjoint_boxes(self, num_boxes_to_add, label, max_width, max_height, verbose=False):
-        for frame in self.labels:
-            bba = BoundingBoxArray(self.labels[frame], max_width=max_width, max_height=max_height)
-            to_add = bba.add_disjoint_boxes(num_boxes_to_add, label=label)
-            bb_to_add = [BoundingBox(frame, label, tl, br) for tl,br in to_add]
+    return (unique,) + tuple(np.bincount(inverse, weight, len(unique)).astype(np.int64) for weight in weights)
 
-            for bb in bb_to_add:
-                if verbose: print('Added new bounding box of label {} to frame {} with coords {} and {}'.format(label, frame, bb.top_left, bb.bottom_right))
-                self.labels[frame].append(bb)
+def _histogram_counts_at(pred_conf, pred_tp, pred_count, label_conf, label_count, thresholds):
+    """`_counts_at` of sorted distinct confidences, each with its number of true positives, predictions and labels."""
+    tp_below = np.concatenate([[0], np.cumsum(pred_tp)])
+    kept_below = np.concatenate([[0], np.cumsum(pred_count)])
+    labels_below = np.concatenate([[0], np.cumsum(label_count)])
 
-class BoundingBoxArray():
-    """A two-dimensional array of bounding boxes."""
+    below = np.searchsorted(pred_conf, thresholds, side='left')
 
-    def __init__(self, bounding_box_list, max_width=None, max_height=None):
-        self.list = bounding_box_list
-        
-        if max_width == None:
-            self.width = int(max([bb.brx for bb in bounding_box_list]))
-        else:
-            self.width = max_width
+    true_pos = tp_below[-1] - tp_below[below]
+    false_pos = kept_below[-1] - kept_below[below] - true_pos
+    false_neg = labels_below[np.searchsorted(label_conf, thresholds, side='left')]
 
-        if max_height == None:
-            self.height = int(max([bb.bry for bb in bounding_box_list]))
-        else:
-            self.height = max_height
+    return true_pos, false_pos, false_neg
 
-        if self.width <= 1 or self.height <= 1:
-            self.width = int(self.width * 1000)
-            self.height = int(self.height * 1000)
-            self.normalized = True
-        else:
-            self.normalized = False
-        
-        self.array = np.zeros((self.height,self.width))
+def _score_arrays(true_pos, false_pos, false_neg):
+    """The elementwise equivalent of `_scores`."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(true_pos == 0, 0.0, true_pos / (true_pos + false_pos))
+        recall = np.where(true_pos == 0, 0.0, true_pos / (true_pos + false_neg))
+        fscore = np.where(true_pos == 0, 0.0, 2 * ((precision * recall) / (precision + recall)))
 
-        for bb in bounding_box_list:
-            self._add_bounding_box_to_array(bb)
-    
-    def _add_bounding_box_to_array(self, bb):
-        tlx,tly = bb.top_left
-        brx,bry = bb.bottom_right
+    return precision, recall, fscore
 
-        if self.normalized:
-            tlx = int(tlx * 1000)
-            tly = int(tly * 1000)
-            brx = int(brx * 1000)
-            bry = int(bry * 1000)
+def _pr_curve(pred_conf, pred_tp, label_conf):
+    """Computes a `PRCurve` at every distinct prediction confidence with one sort."""
+    thresholds = np.unique(pred_conf)[::-1]
 
-        self.array[tly:bry, tlx:brx] = 1
+    precision, recall, fscore = _score_arrays(*_counts_at(pred_conf, pred_tp, label_conf, thresholds))
 
-    def _add_disjoint_bounding_box(self, label='background', min_size=(10,10), decay=0, tries=10):
-        """
-            Tries to add a new non-overlapping bounding box. Returns True if successful, False if not.
-        """
+    return PRCurve(thresholds, precision, recall, fscore)
 
-        if tries == 0: return False
+def _average_precision(curve):
+    """The area under the precision envelope of a `PRCurve` (all-point interpolation)."""
+    if len(curve.thresholds) == 0: return 0.0
 
-        tlx = random.randint(0,self.width - 1)
-        tly = random.randint(0,self.height - 1)
+    envelope = np.maximum.accumulate(curve.precision[::-1])[::-1]
 
-        # pick a random start point
-        while self.array[tly,tlx] != 0:
-            tlx = random.randint(0,self.width - 1)
-            tly = random.randint(0,self.height - 1)
+    return float(np.sum(np.diff(curve.recall, prepend=0.0) * envelope))
 
-        should_grow = True
+def _read_lines(filepath, line_delimiter, chunk_size):
+    """Yields lists of the lines of a file, reading about `chunk_size` characters at a time."""
+    remainder = ''
 
-        cur_width = 0
-        cur_height = 0
+    with open(filepath) as f:
+        while True:
+            chunk = f.read(chunk_size)
 
-        cur_x = tlx
-        cur_y = tly
+            if not chunk: break
 
-        while should_grow and cur_x < self.width - 1 and cur_y < self.height - 1:
-            if cur_width < min_size[0] and cur_height < min_size[1]:
-                if random.randint(0,1) == 0:
-                    if 1 in self.array[tly:cur_y,cur_x + 1]: # collision
-                        return self._add_disjoint_bounding_box(label=label, min_size=min_size, decay=decay, tries=tries-1) # try again
-                    else:
-                        cur_x += 1
-                        cur_width += 1
-                else:
-                    if 1 in self.array[cur_y + 1,tlx:cur_x]: # collision
-                        return self._add_disjoint_bounding_box(label=label, min_size=min_size, decay=decay, tries=tries-1) # try again
-                    else:
-                        cur_y += 1
-                        cur_height += 1
-            elif cur_width < min_size[0]: # subminimal width
-                if 1 in self.array[tly:cur_y,cur_x + 1]: # collision
-                        return self._add_disjoint_bounding_box(label=label, min_size=min_size, decay=decay, tries=tries-1) # try again
-                else:
-                    cur_x += 1
-                    cur_width += 1
-            elif cur_height < min_size[1]: # subminimal height
-                if 1 in self.array[cur_y + 1,tlx:cur_x]: # collision
-                    return self._add_disjoint_bounding_box(label=label, min_size=min_size, decay=decay, tries=tries-1) # try again
-                else:
-                    cur_y += 1
-                    cur_height += 1
-            else: # above minimum thresholds
-                while random.randint(0,1000) > decay and cur_x < self.width - 1 and cur_y < self.height - 1:
-
-                    # randomly expand
-                    if random.randint(0,1) == 0:
-                        if 1 in self.array[tly:cur_y,cur_x + 1]: # collision
-                            self.array[tly:cur_y, tlx:cur_x] = 2
-                            return (tlx,tly),(cur_x,cur_y)
-                        else:
-                            cur_x += 1
-                            cur_width += 1
-                    else:
-                        if 1 in self.array[cur_y + 1,tlx:cur_x]: # collision
-                            self.array[tly:cur_y, tlx:cur_x] = 2
-                            return (tlx,tly),(cur_x,cur_y)
-                        else:
-                            cur_y += 1
-                            cur_height += 1
-                    
-                    decay += 25
+            lines = (remainder + chunk).split(line_delimiter)
+            remainder = lines.pop()
 
-                self.array[tly:cur_y, tlx:cur_x] = 2
-                return (tlx,tly),(cur_x,cur_y)
+            yield lines
 
-        return self._add_disjoint_bounding_box(label=label, min_size=min_size, decay=decay, tries=tries-1) # try again
-    
-    def add_disjoint_boxes(self, num_boxes, label='background', min_width=10, min_height=10, tries=10):
-        added = []
-        for i in range(num_boxes):
-            res = self._add_disjoint_bounding_box(label=label, min_size=(min_width,min_height), tries=tries)
+    if remainder:
+        yield [remainder]
 
+def _frame_outcomes(label_boxes, label_codes, pred_boxes, pred_codes, pred_conf, confidence_threshold, iou_threshold, index=None, matching='any'):
+    """
+        Matches one frame and returns (keep, pred_found, label_found) boolean arrays: the predictions that pass
+        the confidence threshold, the kept predictions that are true positives, and the labels that were found.
+    """
+    keep = np.isnan(pred_conf) | (pred_conf >= confidence_threshold)
 
-            if res != False:
-                if self.normalized:
-                    tl,br = res
-                    tl = tl[0] / 1000, tl[1] / 1000
-                    br = br[0] / 1000, br[1] / 1000
-                    res = tl,br
-                added.append(res)
-        
-        return added
+    pred_idx, label_idx, ious = related_pairs(pred_boxes, pred_codes, label_boxes, label_codes, index)
+
+    if matching != 'any':
+        kept = keep[pred_idx]
+        hit_preds, hit_labels = one_to_one(pred_conf, (pred_idx[kept], label_idx[kept], ious[kept]), len(label_boxes), iou_threshold, matching)
+    else:
+        hit = keep[pred_idx] & (ious >= iou_threshold)
+        hit_preds, hit_labels = pred_idx[hit], label_idx[hit]
+
+    pred_found = np.zeros(len(pred_boxes), dtype=bool)
+    pred_found[hit_preds] = True
+    label_found = np.zeros(len(label_boxes), dtype=bool)
+    label_found[hit_labels] = True
+
+    return keep, pred_found, label_found
+
+def _outcome_counts(keep, pred_found, label_found):
+    """Returns the true positive, false positive and false negative counts of `_frame_outcomes`."""
+    found = int(pred_found.sum())
+
+    return found, int(keep.sum()) - found, len(label_found) - int(label_found.sum())
+
+def _label_counts(label_codes, pred_codes, keep, pred_found, label_found, num_codes):
+    """Returns the (3, num_codes) true positive, false positive and false negative counts of each label code."""
+    return np.stack([np.bincount(pred_codes[pred_found], minlength=num_codes),
+        np.bincount(pred_codes[keep & ~pred_found], minlength=num_codes),
+        np.bincount(label_codes[~label_found], minlength=num_codes)])
+
+def _pack_frames(frames):
+    """
+        Concatenates the (label_boxes, label_codes, pred_boxes, pred_codes, pred_conf) arrays of
+        several frames into one shard of arrays plus frame offsets, which is cheap to send to another process.
+    """
+    _, label_boxes, label_codes, pred_boxes, pred_codes, pred_conf = zip(*frames)
+
+    def offsets(arrays):
+        return np.concatenate([[0], np.cumsum([len(array) for array in arrays])])
+
+    return (np.concatenate(label_boxes), np.concatenate(label_codes), offsets(label_codes),
+        np.concatenate(pred_boxes), np.concatenate(pred_codes), np.concatenate(pred_conf), offsets(pred_codes))
+
+# the most frames packed into one shard for a worker process
+_MAX_SHARD_FRAMES = 1024
+
+def _count_shard(shard, confidence_threshold, iou_threshold, matching='any', report=False):
+    """
+        Counts the frames of a shard made by `_pack_frames`. Returns the (F, 3) true positive, false positive
+        and false negative counts of each frame, and if `report` is True the (3, codes) counts of each label code.
+    """
+    label_boxes, label_codes, label_offsets, pred_boxes, pred_codes, pred_conf, pred_offsets = shard
+
+    frame_counts = np.zeros((len(label_offsets) - 1, 3), dtype=np.int64)
+    num_codes = int(max(label_codes.max(initial=-1), pred_codes.max(initial=-1))) + 1
+    label_counts = np.zeros((3, num_codes), dtype=np.int64) if report else None
+
+    for i in range(len(label_offsets) - 1):
+        labels = slice(label_offsets[i], label_offsets[i + 1])
+        preds = slice(pred_offsets[i], pred_offsets[i + 1])
+
+        outcomes = _frame_outcomes(label_boxes[labels], label_codes[labels],
+            pred_boxes[preds], pred_codes[preds], pred_conf[preds], confidence_threshold, iou_threshold, matching=matching)
+
+        frame_counts[i] = _outcome_counts(*outcomes)
+
+        if report:
+            label_counts += _label_counts(label_codes[labels], pred_codes[preds], *outcomes, num_codes)
+
+    return frame_counts, label_counts
+
+COUNTS_DTYPE = np.dtype([('true_pos', np.int64), ('false_pos', np.int64), ('false_neg', np.int64)])
+
+class MetricsReport(namedtuple('MetricsReport', ['labels', 'label_counts', 'frames', 'frame_counts'])):
+    """
+        The true positive, false positive and false negative counts behind `Detection.metrics`,
+        broken down per label and per frame.
+
+        labels : the labels, in the order of `label_counts`
+        label_counts : a structured array with fields true_pos, false_pos and false_neg for each label
+        frames : the frame_ids, in the order of `frame_counts`
+        frame_counts : a structured array with fields true_pos, false_pos and false_neg for each frame
+    """
+
+    __slots__ = ()
+
+    def label_metrics(self):
+        """Returns a dict of label -> (precision, recall, fscore)."""
+        return {label: _scores(*counts.tolist()) for label,counts in zip(self.labels, self.label_counts)}
+
+    def worst_frames(self, n=10):
+        """Returns the `n` frames with the most false positives plus false negatives, as (frame_id, counts) tuples."""
+        errors = self.frame_counts['false_pos'] + self.frame_counts['false_neg']
+        worst = np.argsort(-errors, kind='stable')[:n]
+
+        return [(self.frames[i], self.frame_counts[i]) for i in worst]
+
+def _add_counts(a, b):
+    """Adds two (3, codes) label count arrays that may cover different numbers of codes."""
+    if a.shape[1] < b.shape[1]:
+        a, b = b, a
+
+    a = a.copy()
+    a[:, :b.shape[1]] += b
+
+    return a
+
+def _as_counts(counts):
+    """Converts (N, 3) counts into a structured array of `COUNTS_DTYPE`."""
+    counts = np.ascontiguousarray(counts, dtype=np.int64).reshape(-1, 3)
+
+    return counts.view(COUNTS_DTYPE).reshape(-1)
+
+def _scores(true_pos, false_pos, false_neg):
+    """Returns precision,recall,fscore for the given counts."""
+    if true_pos == 0: # we made no good predictions. sad!
+        return 0.0,0.0,0.0
+
+    precision = true_pos / (true_pos + false_pos)
+    recall = true_pos / (true_pos + false_neg)
+    fscore = 2 * ( (precision * recall) / (precision + recall))
+
+    return precision,recall,fscore
+
+class BoundingBoxColumns():
+    """
+        Columnar storage for the bounding boxes of any number of frames.
+
+        Behaves like the `dict` of frame_id -> list of `BoundingBox` that `Detection` uses for
+        its labels and predictions, but keeps coordinates, interned label codes and confidences
+        in contiguous arrays grouped by frame. `BoundingBox` objects are only created when a
+        frame is accessed.
+    """
+
+    def __init__(self, dtype=np.float64, capacity=1024):
+        """
+            Parameters
+            ----------
+            dtype : numpy floating dtype :
+                the dtype used to store coordinates and confidences, e.g. `np.float32` to halve memory
+            capacity : int :
+                the number of boxes to allocate room for up front
+        """
+
+        self.dtype = np.dtype(dtype)
+
+        self.coords = np.empty((capacity, 4), dtype=self.dtype)
+        self.label_codes = np.empty(capacity, dtype=np.int32)
+        self.confidences = np.empty(capacity, dtype=self.dtype)
+        self.frame_codes = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+        self.label_names = [] # label code -> label
+        self._label_index = dict()
+        self.frame_ids = [] # frame code -> frame_id, in order of first appearance
+        self._frame_index = dict()
+
+        self._offsets = None # rows of frame code i are offsets[i]:offsets[i + 1] once grouped
+        self._grouped = 0 # the leading rows that are already grouped by frame
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def __iter__(self):
+        return iter(self.frame_ids)
+
+    def __contains__(self, frame_id):
+        return frame_id in self._frame_index
+
+    def __getitem__(self, frame_id):
+        """
+            Returns a tuple of `BoundingBox` views of the boxes in `frame_id`. It is a tuple so that code
+            written for the dict store, like `labels[frame].append(bb)`, fails instead of silently doing nothing.
+        """
+        rows = self._rows(frame_id)
+
+        names = self.label_names
+        confidences = [None if c != c else c for c in self.confidences[rows].tolist()]
+
+        return tuple(BoundingBox(frame_id, names[code], (tlx,tly), (brx,bry), confidence)
+            for (tlx,tly,brx,bry),code,confidence in zip(self.coords[rows].tolist(), self.label_codes[rows].tolist(), confidences))
+
+    def keys(self):
+        return list(self.frame_ids)
+
+    def values(self):
+        return [self[frame_id] for frame_id in self.frame_ids]
+
+    def items(self):
+        return [(frame_id, self[frame_id]) for frame_id in self.frame_ids]
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the box arrays."""
+        return self.coords.nbytes + self.label_codes.nbytes + self.confidences.nbytes + self.frame_codes.nbytes
+
+    def append(self, bb):
+        """Add a `BoundingBox` to its frame."""
+        self.append_box(bb.frame_id, bb.label, bb.tlx, bb.tly, bb.brx, bb.bry, bb.confidence)
+
+    def append_box(self, frame_id, object_label, tlx, tly, brx, bry, confidence=None):
+        """Add a single box without creating a `BoundingBox`."""
+        self._reserve(1)
+
+        i = self.size
+        self.coords[i] = (tlx, tly, brx, bry)
+        self.label_codes[i] = self._intern_label(object_label)
+        self.confidences[i] = np.nan if confidence is None else confidence
+        self.frame_codes[i] = self._intern_frame(frame_id)
+        self.size += 1
+
+        self._offsets = None
+
+    def extend(self, frame_ids, object_labels, coords, confidences=None):
+        """
+            Add many boxes at once.
+
+            Parameters
+            ----------
+            frame_ids : sequence of N hashable items :
+                the frame of each box
+            object_labels : sequence of N labels :
+                the label of each box
+            coords : array-like (N, 4) :
+                rows of (top_left_x, top_left_y, bottom_right_x, bottom_right_y)
+            confidences : array-like (N,) or None :
+                the confidence of each box, where NaN (or None for all boxes) means no confidence
+        """
+        coords = np.asarray(coords, dtype=self.dtype).reshape(-1, 4)
+        n = len(coords)
+
+        if n == 0: return # the arrays may be read-only memory maps
+
+        self._reserve(n)
+
+        i = self.size
+        self.coords[i:i + n] = coords
+        self.label_codes[i:i + n] = self._intern_many(object_labels, self._intern_label)
+        self.confidences[i:i + n] = np.nan if confidences is None else confidences
+        self.frame_codes[i:i + n] = self._intern_many(frame_ids, self._intern_frame)
+        self.size += n
+
+        self._offsets = None
+
+    def extend_frame(self, frame_id, object_labels, coords, confidences=None):
+        """
+            Add many boxes of one frame at once, see `extend`. `object_labels` may be a single
+            label shared by all the boxes.
+        """
+        coords = np.asarray(coords, dtype=self.dtype).reshape(-1, 4)
+        n = len(coords)
+
+        if n == 0: # the arrays may be read-only memory maps, so only the frame is added
+            self._intern_frame(frame_id)
+            self._offsets = None
+            return
+
+        self._reserve(n)
+
+        i = self.size
+        self.coords[i:i + n] = coords
+
+        if isinstance(object_labels, str):
+            self.label_codes[i:i + n] = self._intern_label(object_labels)
+        else:
+            self.label_codes[i:i + n] = self._intern_many(object_labels, self._intern_label)
+
+        self.confidences[i:i + n] = np.nan if confidences is None else confidences
+        self.frame_codes[i:i + n] = self._intern_frame(frame_id)
+        self.size += n
+
+        self._offsets = None
+
+    def extend_runs(self, frame_ids, object_labels, counts, coords, confidences=None):
+        """
+            Add many boxes at once, given as runs of consecutive boxes that share a frame and a label.
+            Only the runs are interned, so this is cheaper than `extend` when runs are long.
+
+            Parameters
+            ----------
+            frame_ids : sequence of R hashable items :
+                the frame of each run
+            object_labels : sequence of R labels :
+                the label of each run
+            counts : sequence of R ints :
+                the number of boxes in each run
+            coords, confidences :
+                the N = sum(counts) boxes, see `extend`
+        """
+        coords = np.asarray(coords, dtype=self.dtype).reshape(-1, 4)
+        counts = np.asarray(counts, dtype=np.int64).reshape(-1)
+        n = len(coords)
+
+        if counts.sum() != n:
+            raise RuntimeError('Unable to process runs that do not add up to the number of boxes!')
+
+        if n == 0: # the arrays may be read-only memory maps, so only the frames are added
+            for frame in frame_ids:
+                self._intern_frame(frame)
+
+            self._offsets = None
+            return
+
+        self._reserve(n)
+
+        i = self.size
+        self.coords[i:i + n] = coords
+        self.label_codes[i:i + n] = np.repeat(np.array([self._intern_label(label) for label in object_labels], dtype=np.int64), counts)
+        self.confidences[i:i + n] = np.nan if confidences is None else confidences
+        self.frame_codes[i:i + n] = np.repeat(np.array([self._intern_frame(frame) for frame in frame_ids], dtype=np.int64), counts)
+        self.size += n
+
+        self._offsets = None
+
+    def frame_arrays(self, frame_id):
+        """
+            Returns (coordinates, label codes, confidences) arrays of the boxes in `frame_id`,
+            where coordinates are (N, 4) rows of (tlx, tly, brx, bry) and a missing confidence is NaN.
+
+            The arrays are views into this storage and must not be modified.
+        """
+        rows = self._rows(frame_id)
+
+        return self.coords[rows], self.label_codes[rows], self.confidences[rows]
+
+    @classmethod
+    def from_dict(cls, bb_dict, dtype=np.float64):
+        """Returns a `BoundingBoxColumns` holding the boxes of a dict of frame_id -> list of BoundingBox."""
+        columns = cls(dtype=dtype, capacity=max(1, sum(len(bbs) for bbs in bb_dict.values())))
+
+        for frame in bb_dict:
+            columns._intern_frame(frame)
+
+            bbs = bb_dict[frame]
+
+            if len(bbs) > 0:
+                coords, _, confidences = _boxes_to_arrays(bbs, dict())
+                columns.extend_frame(frame, [bb.label for bb in bbs], coords, confidences)
+
+        return columns
+
+    _ARRAYS = ['coords', 'label_codes', 'confidences', 'frame_codes']
+
+    def save(self, directory):
+        """
+            Saves the boxes to `directory` as one .npy file per array plus a `header.json`
+            holding the frame ids and labels, which must be JSON serializable.
+        """
+        if self._offsets is None:
+            self._group_frames()
+
+        header = {
+            'version': 1,
+            'dtype': self.dtype.str,
+            'size': self.size,
+            'label_names': self.label_names,
+            'frame_ids': self.frame_ids,
+        }
+
+        # serialized before anything is written, so an unsupported frame id or label leaves no partial save
+        try:
+            header = json.dumps(header)
+        except (TypeError, ValueError) as e:
+            raise RuntimeError('Frame ids and labels must be JSON serializable to be saved: {}!'.format(e))
+
+        os.makedirs(directory, exist_ok=True)
+
+        for name in self._ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name)[:self.size])
+
+        np.save(os.path.join(directory, 'offsets.npy'), self._offsets)
+
+        with open(os.path.join(directory, 'header.json'), 'w') as f:
+            f.write(header)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+            Loads boxes saved with `save`. If `mmap` is True the arrays are memory-mapped read-only
+            instead of read, so loading is immediate and processes share the same pages. Adding
+            boxes afterwards copies the arrays into memory.
+        """
+        with open(os.path.join(directory, 'header.json')) as f:
+            header = json.load(f)
+
+        if header.get('version') != 1:
+            raise RuntimeError('Unsupported BoundingBoxColumns format in {}!'.format(directory))
+
+        def hashable(item):
+            return tuple(hashable(i) for i in item) if isinstance(item, list) else item
+
+        columns = cls(dtype=np.dtype(header['dtype']), capacity=0)
+
+        for name in cls._ARRAYS:
+            setattr(columns, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None))
+
+        columns.size = header['size']
+        columns._offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        columns._grouped = columns.size
+
+        columns.label_names = [hashable(label) for label in header['label_names']]
+        columns._label_index = {label: code for code,label in enumerate(columns.label_names)}
+        columns.frame_ids = [hashable(frame) for frame in header['frame_ids']]
+        columns._frame_index = {frame: code for code,frame in enumerate(columns.frame_ids)}
+
+        return columns
+
+    def _intern_label(self, object_label):
+        if isinstance(object_label, np.generic): # numpy scalars are not JSON serializable for `save`
+            object_label = object_label.item()
+
+        code = self._label_index.get(object_label)
+
+        if code is None:
+            code = self._label_index[object_label] = len(self.label_names)
+            self.label_names.append(object_label)
+
+        return code
+
+    def _intern_frame(self, frame_id):
+        if isinstance(frame_id, np.generic): # numpy scalars are not JSON serializable for `save`
+            frame_id = frame_id.item()
+
+        code = self._frame_index.get(frame_id)
+
+        if code is None:
+            code = self._frame_index[frame_id] = len(self.frame_ids)
+            self.frame_ids.append(frame_id)
+
+        return code
+
+    def _intern_many(self, values, intern):
+        """Intern every item of `values` in order of first appearance and return their codes."""
+        array = None
+
+        # only values of one type take the vectorized path, as np.asarray would turn mixed values like 1 and '1' into equal strings
+        if isinstance(values, np.ndarray):
+            array = values
+        elif len(values) > 0 and all(type(value) is type(values[0]) for value in values):
+            try:
+                array = np.asarray(values)
+            except ValueError:
+                array = None
+
+        if array is not None and array.ndim == 1 and array.dtype.kind in 'USiuf':
+            uniques, first, inverse = np.unique(array, return_index=True, return_inverse=True)
+            codes = np.empty(len(uniques), dtype=np.int64)
+
+            for u in np.argsort(first):
+                codes[u] = intern(uniques[u].item())
+
+            return codes[inverse.reshape(-1)]
+
+        return np.array([intern(value) for value in values], dtype=np.int64)
+
+    def _reserve(self, num_boxes):
+        """Grow the arrays so that `num_boxes` more boxes fit."""
+        needed = self.size + num_boxes
+
+        if needed <= len(self.coords): return
+
+        capacity = max(needed, 2 * len(self.coords))
+
+        for name in self._ARRAYS:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _rows(self, frame_id):
+        """Returns the slice of rows belonging to `frame_id`."""
+        code = self._frame_index[frame_id]
+
+        if self._offsets is None:
+            self._group_frames()
+
+        return slice(self._offsets[code], self._offsets[code + 1])
+
+    def _group_frames(self):
+        """
+            Stably reorder the rows so that each frame is contiguous, and compute the frame offsets.
+            Only the rows added since the last call are sorted, and then merged into the grouped rows.
+        """
+        n = self.size
+        grouped = self._grouped
+        frame_codes = self.frame_codes[:n]
+        tail = frame_codes[grouped:]
+
+        if len(tail) > 0 and (np.any(tail[1:] < tail[:-1]) or (grouped > 0 and tail[0] < frame_codes[grouped - 1])):
+            tail_order = np.argsort(tail, kind='stable') + grouped
+
+            # rows of the tail go after the grouped rows of the same frame
+            positions = np.searchsorted(frame_codes[:grouped], frame_codes[tail_order], side='right')
+            order = np.insert(np.arange(grouped), positions, tail_order)
+
+            for name in self._ARRAYS:
+                array = getattr(self, name)
+                array[:n] = array[:n][order]
+
+        self._grouped = n
+
+        counts = np.bincount(self.frame_codes[:n], minlength=len(self.frame_ids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+class ParseCache():
+    """
+        An on-disk, size-bounded LRU cache of parsed CSV files for `Detection.from_csv`.
+
+        Entries are keyed by the file's path, modification time, size and content hash, and are
+        stored in the `BoundingBoxColumns.save` format so that hits are memory-mapped rather than parsed.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        """
+            Parameters
+            ----------
+            directory : str :
+                where to keep the cache, created if it does not exist
+            max_bytes : int :
+                the total size of the cache after which the least recently used entries are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, filepath, delimiter=',', line_delimiter='\n', dtype=np.float64):
+        """Returns the cache key of parsing `filepath` with the given settings."""
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+
+        content = hashlib.blake2b(digest_size=16)
+
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                content.update(block)
+
+        settings = repr((stat.st_mtime_ns, stat.st_size, content.hexdigest(), delimiter, line_delimiter, np.dtype(dtype).str))
+
+        # entries of the same path share a prefix so that stale ones can be dropped
+        return '{}-{}'.format(self._digest(path), self._digest(settings))
+
+    def get(self, key):
+        """Returns the cached `BoundingBoxColumns` for `key`, or None on a miss."""
+        entry = os.path.join(self.directory, key)
+
+        try:
+            columns = BoundingBoxColumns.load(entry)
+        except (OSError, ValueError, KeyError, RuntimeError):
+            # unreadable or of another format version; removed so that `put` can store a fresh entry
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        os.utime(entry) # mark as recently used
+
+        return columns
+
+    def put(self, key, columns):
+        """Stores `columns` under `key`, replacing older entries of the same file and evicting if needed."""
+        prefix = key.split('-')[0] + '-'
+
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name != key:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+        # written aside and renamed into place so that readers never see a partial entry
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        columns.save(tmp)
+
+        try:
+            os.rename(tmp, os.path.join(self.directory, key))
+        except OSError: # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self._evict()
+
+    def clear(self):
+        """Removes every entry."""
+        for name in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+
+            if name.startswith('.') or not os.path.isdir(entry): continue
+
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError: # removed by another process
+                continue
+
+        total = sum(size for _,size,_ in entries)
+
+        for _,size,entry in sorted(entries):
+            if total <= self.max_bytes: break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    @staticmethod
+    def _digest(text):
+        return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+class Detection():
+    """
+        An abstract Detection encompassing any number of frames,
+        absolute labels, and/or predictions.
+    """
+
+    def __init__(self, labels=None, predictions=None, frames=None, columnar=False, dtype=np.float64):
+        """
+            Initialize this `Detection` object.
+
+            Paramters
+            ---------
+            labels : iterable of
+            
+            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y))` 
+            
+            or
+            
+            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), confidence)`
+            
+            or
+            
+            `BoundingBox`::
+
+            All of the ground-truth labels for a given set of frames.
+
+            predictions : iterable of
+
+            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y))` 
+            
+            or
+            
+            `(frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), confidence)`
+            
+            or
+            
+            `BoundingBox`::
+
+            All of the predictions for a given set of frames.
+
+            TODO frames : iterable of `Frame` or `channels`x`rows`x`columns` numpy array
+
+            columnar : bool ::
+                if True, store labels and predictions in a `BoundingBoxColumns` instead of a
+                dict of lists of `BoundingBox`, which uses far less memory for many boxes
+
+            dtype : numpy floating dtype ::
+                the dtype of coordinates and confidences when `columnar` is True
+        """
+
+        self.columnar = columnar
+        self.dtype = dtype
+        self._evaluators = weakref.WeakSet() # evaluators stop being updated once they are no longer referenced
+        self._vocab = dict() # label -> label code, shared by all evaluations of this detection
+
+        if labels != None:
+            self.labels = self._handle_new_bounding_boxes(labels)
+        else:
+            self.labels = None
+
+        if predictions != None:
+            self.predictions = self._handle_new_bounding_boxes(predictions)
+        else:
+            self.predictions = None
+
+        if frames != None:
+            pass # TODO
+
+    def _handle_new_bounding_boxes(self, bb_iter):
+        """
+            Converts all possible bounding-box array formats into one format.
+
+            Parameters
+            ----------
+            bb_array : iterable of bounding boxes in the format described in
+            `__init__`
+        """
+
+        # (frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y), confidence)
+
+        dict_to_ret = self._new_store()
+
+        if isinstance(dict_to_ret, BoundingBoxColumns):
+            # gather plain rows and add them in one batch rather than creating BoundingBox objects
+            rows = []
+
+            for item in bb_iter:
+                if type(item) != BoundingBox:
+                    item = self._handle_bb_args(tuple(item), as_row=True)
+                else:
+                    item = item.frame_id, item.label, item.tlx, item.tly, item.brx, item.bry, item.confidence
+
+                rows.append(item)
+
+            if len(rows) > 0:
+                frame_ids, labels, tlx, tly, brx, bry, confidences = zip(*rows)
+                confidences = [np.nan if c is None else c for c in confidences]
+
+                dict_to_ret.extend(frame_ids, labels, np.column_stack([tlx, tly, brx, bry]), confidences)
+
+            return dict_to_ret
+
+        for item in bb_iter:
+            if type(item) != BoundingBox:
+                item = self._handle_bb_args(tuple(item))
+
+            self._append_bounding_box(item, dict_to_ret)
+        
+        return dict_to_ret
+
+    def _new_store(self):
+        """Returns an empty labels/predictions store of the kind this `Detection` was configured with."""
+        if self.columnar:
+            return BoundingBoxColumns(dtype=self.dtype)
+
+        return dict()
+
+    def _append_bounding_box(self, bb, bb_dict):
+        """Add a BoundingBox to the specified label/predictions store"""
+        if isinstance(bb_dict, BoundingBoxColumns):
+            bb_dict.append(bb)
+        elif bb.frame_id not in bb_dict:
+            bb_dict[bb.frame_id] = [bb]
+        else:
+            bb_dict[bb.frame_id].append(bb)
+
+        for evaluator in self._evaluators:
+            evaluator.touch(bb.frame_id)
+
+    def from_csv(self, label_filepath=None, pred_filepath=None, delimiter=',', line_delimiter='\n', chunk_size=1 << 20, cache=None):
+        """
+            Loads the data from the specified filepath(s) and formats them appropriately.
+
+            The CSV must be formatted as follows:
+
+            frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y
+
+            or 
+
+            frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y, confidence
+
+            Parameters
+            ----------
+            label_filepath : str ::
+                the relative filepath to the csv file containing the ground truth labels
+
+            pred_filepath : str ::
+                the relative filepath to the csv file containing the predicted labels
+
+            delimiter : str ::
+                the delimiting character or str between entries in a row
+
+            line_delimiter : str ::
+                the delimiting character or str between rows
+
+            chunk_size : int ::
+                the number of characters read and parsed at a time, which bounds the memory
+                used while parsing regardless of file size
+
+            cache : ParseCache or None ::
+                if given, reuse the parsed contents of files that have not changed since they were
+                last parsed. Cached files are loaded into (memory-mapped) columnar storage
+
+            Returns
+            -------
+            None
+        """
+
+        def digest(filepath):
+            if cache is None:
+                return self._digest_csv(filepath, delimiter, line_delimiter, chunk_size)
+
+            key = cache.key(filepath, delimiter, line_delimiter, self.dtype)
+            store = cache.get(key)
+
+            if store is None:
+                store = self._digest_csv(filepath, delimiter, line_delimiter, chunk_size, BoundingBoxColumns(dtype=self.dtype))
+                cache.put(key, store)
+
+            return store
+
+        if label_filepath != None:
+            self.labels = digest(label_filepath)
+        
+        if pred_filepath != None:
+            self.predictions = digest(pred_filepath)
+
+    def save(self, path):
+        """
+            Saves the labels and predictions to the directory `path` in a binary format
+            that `load` can memory-map. See `BoundingBoxColumns.save`.
+        """
+        for name in ['labels', 'predictions']:
+            store = getattr(self, name)
+
+            if store is None: continue
+
+            if not isinstance(store, BoundingBoxColumns):
+                store = BoundingBoxColumns.from_dict(store, dtype=self.dtype)
+
+            store.save(os.path.join(path, name))
+
+    def load(self, path, mmap=True):
+        """
+            Loads labels and predictions saved with `save` into columnar storage. Labels or predictions
+            that were not saved are cleared, so they are never paired with boxes from before the load.
+
+            Parameters
+            ----------
+            path : str ::
+                the directory passed to `save`
+            mmap : bool ::
+                if True, memory-map the arrays instead of reading them
+        """
+        for name in ['labels', 'predictions']:
+            directory = os.path.join(path, name)
+
+            setattr(self, name, BoundingBoxColumns.load(directory, mmap=mmap) if os.path.isdir(directory) else None)
+
+    def _digest_csv(self, filepath, delimiter, line_delimiter, chunk_size=1 << 20, dict_to_ret=None):
+        """Digest a csv file into a store where frames are keys and lists of BoundingBox are values"""
+
+        if dict_to_ret is None:
+            dict_to_ret = self._new_store()
+
+        for lines in _read_lines(filepath, line_delimiter, chunk_size):
+            self._add_csv_lines(lines, delimiter, dict_to_ret)
+                    
+        return dict_to_ret
+
+    def _add_csv_lines(self, lines, delimiter, bb_dict):
+        """Parse a chunk of csv rows and add them to the specified label/predictions store"""
+        rows = [line.split(delimiter) for line in lines]
+        rows = [row for row in rows if len(row) > 1]
+
+        if len(rows) == 0: return
+
+        for row in rows:
+            if len(row) != 6 and len(row) != 7:
+                raise RuntimeError('Incorrect CSV row format!')
+
+        frame_ids = [row[0].strip() for row in rows]
+        labels = [row[1].strip() for row in rows]
+        coords = np.array([row[2:6] for row in rows]).astype(np.float64)
+
+        confidences = np.full(len(rows), np.nan)
+        with_confidence = [i for i,row in enumerate(rows) if len(row) == 7]
+
+        if len(with_confidence) > 0:
+            confidences[with_confidence] = np.array([rows[i][6] for i in with_confidence]).astype(np.float64)
+
+        if isinstance(bb_dict, BoundingBoxColumns):
+            bb_dict.extend(frame_ids, labels, coords, confidences)
+            return
+
+        confidences = [None if c != c else c for c in confidences.tolist()]
+
+        for frame_id,label,(tlx,tly,brx,bry),confidence in zip(frame_ids, labels, coords.tolist(), confidences):
+            self._append_bounding_box(BoundingBox(frame_id, label, (tlx,tly), (brx,bry), confidence=confidence), bb_dict)
+
+    def add_label(self, *args):
+        """
+            Add a prediction of the form BoundingBox or
+
+            `frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y(, confidence)`
+
+            where confidence is optional
+        """
+        try:
+            if self.labels == None: self.labels = self._new_store()
+
+            self._add_bounding_box(args, self.labels)
+        except Exception as e:
+            self.labels = None
+            raise e
+
+    def add_prediction(self, *args):
+        """
+            Add a prediction of the form BoundingBox or
+
+            `frame_id, object_label, top_left_x, top_left_y, bottom_right_x, bottom_right_y{, confidence}` or
+
+            `frame_id, object_label, (top_left_x, top_left_y), (bottom_right_x, bottom_right_y){, confidence}`
+
+            where confidence is optional
+        """
+        try:
+            if self.predictions == None: self.predictions = self._new_store()
+            self._add_bounding_box(args, self.predictions)
+        except Exception as e:
+            self.predictions = None
+            raise e
+    
+    def add_labels_array(self, frame_id, boxes, labels, scores=None):
+        """
+            Add all the labels of a frame at once from arrays, without creating a `BoundingBox` per box.
+
+            Parameters
+            ----------
+            frame_id : any hashable item ::
+                the frame that all the boxes belong to
+            boxes : array-like (N, 4) ::
+                rows of (top_left_x, top_left_y, bottom_right_x, bottom_right_y)
+            labels : str or array-like (N,) ::
+                the label of each box, or one label for all of them
+            scores : array-like (N,) or None ::
+                the confidence of each box
+        """
+        if self.labels == None: self.labels = BoundingBoxColumns(dtype=self.dtype)
+
+        self._add_arrays(frame_id, boxes, labels, scores, self.labels)
+
+    def add_predictions_array(self, frame_id, boxes, labels, scores=None):
+        """
+            Add all the predictions of a frame at once from arrays, e.g. straight from a detector.
+            See `add_labels_array`.
+        """
+        if self.predictions == None: self.predictions = BoundingBoxColumns(dtype=self.dtype)
+
+        self._add_arrays(frame_id, boxes, labels, scores, self.predictions)
+
+    def _add_arrays(self, frame_id, boxes, labels, scores, bb_dict):
+        """Add the boxes of one frame to the specified label/predictions store"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+        if isinstance(labels, str):
+            labels = [labels] * len(boxes)
+
+        if scores is not None:
+            scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+
+        if len(labels) != len(boxes) or (scores is not None and len(scores) != len(boxes)):
+            raise RuntimeError('Unable to process BoundingBox arrays of different lengths!')
+
+        if isinstance(bb_dict, BoundingBoxColumns):
+            bb_dict.extend_frame(frame_id, labels, boxes, scores)
+
+            for evaluator in self._evaluators:
+                evaluator.touch(frame_id)
+
+            return
+
+        scores = [None] * len(boxes) if scores is None else scores.tolist()
+
+        for (tlx,tly,brx,bry),label,score in zip(boxes.tolist(), labels, scores):
+            self._append_bounding_box(BoundingBox(frame_id, label, (tlx,tly), (brx,bry), score), bb_dict)
+
+    def _add_bounding_box(self, bb_args, bb_dict):
+        """Add a bounding box to the specified label/predictions dict"""
+        bb = self._handle_bb_args(bb_args)
+
+        self._append_bounding_box(bb, bb_dict)
+
+    def track_metrics(self, confidence_threshold=0.5, iou_threshold=0.5):
+        """
+            Returns an `IncrementalEvaluator` that keeps the metrics of this detection up to date
+            as boxes are added with `add_label` and `add_prediction`, re-matching only the frames that changed.
+
+            The detection only holds a weak reference to the evaluator, so it is detached once dropped.
+            Streaming into earlier frames is cheapest with the dict store: a columnar store has to move
+            its rows to keep each frame contiguous, which costs time proportional to its size on each query.
+        """
+        evaluator = IncrementalEvaluator(self, confidence_threshold=confidence_threshold, iou_threshold=iou_threshold)
+        self._evaluators.add(evaluator)
+
+        return evaluator
+
+    def _handle_bb_args(self, args, as_row=False):
+        """
+            Convert the arglist in any format to a BoundingBox and return it, or if `as_row` is True,
+            to a `(frame_id, object_label, tlx, tly, brx, bry, confidence)` tuple
+        """
+        if len(args) == 1: # BoundingBox
+            if type(args[0]) == BoundingBox:
+                bb = args[0]
+
+                if as_row: return bb.frame_id, bb.label, bb.tlx, bb.tly, bb.brx, bb.bry, bb.confidence
+                return bb
+        elif len(args) in [4,5]: # frame_id, object_label, top_left, bottom_right(, confidence)
+            if as_row: return tuple(args[:2]) + tuple(args[2]) + tuple(args[3]) + (args[4] if len(args) == 5 else None,)
+            return BoundingBox(*args)
+        elif len(args) == 6:
+            if as_row: return tuple(args) + (None,)
+            return BoundingBox(*args[:2], (args[2], args[3]), (args[4], args[5]))
+        elif len(args) == 7:
+            if as_row: return tuple(args)
+            return BoundingBox(*args[:2], (args[2], args[3]), (args[4], args[5]), args[6])
+
+        raise RuntimeError('Unable to process BoundingBox arguments!')
+
+    def _frame_arrays(self, vocab):
+        """
+            Yields (frame_id, label_boxes, label_codes, pred_boxes, pred_codes, pred_conf) for every frame
+            with labels, where label codes are interned in `vocab` and a frame without predictions has empty arrays.
+        """
+        read_labels = _frame_reader(self.labels, vocab)
+        read_predictions = _frame_reader(self.predictions, vocab)
+
+        no_predictions = np.empty((0, 4)), np.empty(0, dtype=np.int64), np.empty(0)
+
+        for frame in self.labels:
+            label_boxes, label_codes, _ = read_labels(frame)
+
+            if frame in self.predictions:
+                predictions = read_predictions(frame)
+            else:
+                predictions = no_predictions
+
+            yield (frame, label_boxes, label_codes) + tuple(predictions)
+
+    def metrics(self, confidence_threshold=0.5, iou_threshold=0.5, vectorized=True, workers=None, matching='any', report=False):
+        """
+            Parameters
+            ----------
+            confidence_threshold : float ::
+                the threshold under which predicted bounding boxes will be filtered out, as if they were not predicted at all
+            iou_threshold : float ::
+                the threshold for overlapping bounding boxes to determine a valid match
+            vectorized : bool ::
+                if True (default), match each frame with one batched IoU matrix instead of
+                calling `BoundingBox.matches` for every prediction
+            workers : int or None ::
+                if greater than 1, evaluate shards of frames in a pool of this many processes
+            matching : str ::
+                'any' (default) counts a prediction as a true positive if it matches any label, so
+                duplicate predictions of one object are all true positives. 'greedy' and 'hungarian'
+                assign predictions and labels one-to-one, see `one_to_one`
+            report : bool ::
+                if True, also return a `MetricsReport` of per-label and per-frame counts,
+                gathered in the same pass
+
+            Returns
+            -------
+            a tuple of floats for precision,recall,fscore, followed by a `MetricsReport` if `report` is True
+        """
+        if self.labels == None:
+            raise RuntimeError('There are no labels associated with this detection!')
+        if self.predictions == None:
+            raise RuntimeError('There are no predictions associated with this detection!')
+        if matching not in MATCHING:
+            raise RuntimeError('Unknown matching {}!'.format(matching))
+
+        if not vectorized:
+            if matching != 'any' or report or (workers is not None and workers > 1):
+                raise RuntimeError('One-to-one matching, reports and workers are only available when vectorized!')
+
+            return self._metrics_per_box(confidence_threshold, iou_threshold)
+
+        if workers is not None and workers > 1:
+            frame_counts, label_counts = self._metrics_parallel(confidence_threshold, iou_threshold, workers, matching, report)
+        else:
+            frame_counts = []
+            label_counts = np.zeros((3, 0), dtype=np.int64)
+
+            for frame,label_boxes,label_codes,pred_boxes,pred_codes,pred_conf in self._frame_arrays(self._vocab):
+                outcomes = _frame_outcomes(label_boxes, label_codes, pred_boxes, pred_codes, pred_conf,
+                    confidence_threshold, iou_threshold, matching=matching)
+
+                frame_counts.append(_outcome_counts(*outcomes))
+
+                if report:
+                    label_counts = _add_counts(label_counts, _label_counts(label_codes, pred_codes, *outcomes, len(self._vocab)))
+
+            frame_counts = np.array(frame_counts, dtype=np.int64).reshape(-1, 3)
+
+        scores = _scores(*frame_counts.sum(axis=0).tolist())
+
+        if not report:
+            return scores
+
+        label_counts = _add_counts(label_counts, np.zeros((3, len(self._vocab)), dtype=np.int64))
+        present = np.flatnonzero(label_counts.any(axis=0))
+        names = list(self._vocab)
+
+        return scores + (MetricsReport([names[code] for code in present], _as_counts(label_counts[:, present].T),
+            list(self.labels), _as_counts(frame_counts)),)
+
+    def _metrics_parallel(self, confidence_threshold, iou_threshold, workers, matching='any', report=False):
+        """
+            Evaluates shards of frames across a pool of `workers` processes, and returns the (F, 3) counts
+            of each frame and the (3, codes) counts of each label code (or None), see `_count_shard`.
+        """
+        frames_per_shard = min(max(1, -(-len(self.labels) // (4 * workers))), _MAX_SHARD_FRAMES)
+
+        def shards():
+            frames = []
+
+            for frame in self._frame_arrays(self._vocab):
+                frames.append(frame)
+
+                if len(frames) == frames_per_shard:
+                    yield _pack_frames(frames)
+                    frames = []
+
+            if len(frames) > 0:
+                yield _pack_frames(frames)
+
+        frame_counts = [np.zeros((0, 3), dtype=np.int64)]
+        label_counts = np.zeros((3, 0), dtype=np.int64)
+
+        def collect(future):
+            nonlocal label_counts
+
+            shard_frames, shard_labels = future.result()
+
+            frame_counts.append(shard_frames)
+
+            if report:
+                label_counts = _add_counts(label_counts, shard_labels)
+
+        # only a few shards are packed and in flight at once, so memory does not grow with the dataset.
+        # Results are collected in submission order to keep the frame counts in frame order
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = deque()
+
+            for shard in shards():
+                futures.append(pool.submit(_count_shard, shard, confidence_threshold, iou_threshold, matching, report))
+
+                if len(futures) >= 2 * workers:
+                    collect(futures.popleft())
+
+            while len(futures) > 0:
+                collect(futures.popleft())
+
+        return np.concatenate(frame_counts), label_counts
+
+    def match_records(self, iou_threshold=0.5, matching='any'):
+        """
+            Matches every prediction against the labels of its frame once, regardless of confidence,
+            so that results for any confidence threshold can be derived without rescanning the frames.
+
+            Parameters
+            ----------
+            iou_threshold : float ::
+                the threshold for overlapping bounding boxes to determine a valid match
+            matching : str ::
+                'any' or 'greedy', see `metrics`
+
+            Returns
+            -------
+            a `MatchRecords` covering every frame with labels
+        """
+        records = self._match_records(np.array([iou_threshold], dtype=np.float64), matching)
+
+        return records._replace(pred_tp=records.pred_tp[0], label_conf=records.label_conf[0])
+
+    def _match_records(self, iou_thresholds, matching='any'):
+        """`match_records` at each of the (I,) `iou_thresholds`, with (I, P) pred_tp and (I, L) label_conf."""
+        if self.labels == None:
+            raise RuntimeError('There are no labels associated with this detection!')
+        if self.predictions == None:
+            raise RuntimeError('There are no predictions associated with this detection!')
+
+        vocab = self._vocab
+
+        pred_conf, pred_tp, pred_labels, label_conf, label_labels = [], [], [], [], []
+
+        for frame,label_boxes,label_codes,pred_boxes,pred_codes,conf in self._frame_arrays(vocab):
+            conf = np.where(np.isnan(conf), np.inf, conf)
+
+            pairs = related_pairs(pred_boxes, pred_codes, label_boxes, label_codes)
+            tp, best = _frame_records(conf, pairs, len(label_boxes), iou_thresholds, matching)
+
+            pred_conf.append(conf)
+            pred_tp.append(tp)
+            pred_labels.append(pred_codes)
+            label_conf.append(best)
+            label_labels.append(label_codes)
+
+        def join(arrays, dtype, shape=(0,)):
+            return np.concatenate(arrays, axis=-1).astype(dtype, copy=False) if len(arrays) > 0 else np.empty(shape, dtype=dtype)
+
+        num_iou = len(iou_thresholds)
+
+        return MatchRecords(join(pred_conf, np.float64), join(pred_tp, bool, (num_iou, 0)), join(pred_labels, np.int64),
+            join(label_conf, np.float64, (num_iou, 0)), join(label_labels, np.int64), list(vocab))
+
+    def metrics_grid(self, confidence_thresholds=(0.5,), iou_thresholds=np.linspace(0.5, 0.95, 10), matching='any'):
+        """
+            Computes metrics for every combination of confidence and IoU thresholds while
+            computing the IoUs of each frame only once. The default IoU thresholds are the
+            COCO-style 0.50:0.05:0.95.
+
+            Parameters
+            ----------
+            confidence_thresholds : iterable of float ::
+                the thresholds under which predicted bounding boxes will be filtered out
+            iou_thresholds : iterable of float ::
+                the thresholds for overlapping bounding boxes to determine a valid match
+            matching : str ::
+                'any' or 'greedy', see `metrics`
+
+            Returns
+            -------
+            a `MetricsGrid` of (len(iou_thresholds), len(confidence_thresholds)) arrays
+        """
+        iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64).reshape(-1)
+        confidence_thresholds = np.asarray(confidence_thresholds, dtype=np.float64).reshape(-1)
+
+        records = self._match_records(iou_thresholds, matching)
+
+        precision = np.empty((len(iou_thresholds), len(confidence_thresholds)))
+        recall = np.empty_like(precision)
+        fscore = np.empty_like(precision)
+
+        for i in range(len(iou_thresholds)):
+            counts = _counts_at(records.pred_conf, records.pred_tp[i], records.label_conf[i], confidence_thresholds)
+            precision[i], recall[i], fscore[i] = _score_arrays(*counts)
+
+        return MetricsGrid(iou_thresholds, confidence_thresholds, precision, recall, fscore)
+
+    def pr_curve(self, iou_threshold=0.5, label=None, matching='any'):
+        """
+            Computes precision, recall and fscore at every distinct prediction confidence in one pass.
+
+            Parameters
+            ----------
+            iou_threshold : float ::
+                the threshold for overlapping bounding boxes to determine a valid match
+            label : str or None ::
+                if given, only consider boxes with this label
+            matching : str ::
+                'any' or 'greedy', see `metrics`
+
+            Returns
+            -------
+            a `PRCurve`
+        """
+        records = self.match_records(iou_threshold, matching)
+
+        if label is None:
+            return _pr_curve(records.pred_conf, records.pred_tp, records.label_conf)
+
+        code = records.label_names.index(label) if label in records.label_names else -1
+        preds = records.pred_labels == code
+        labels = records.label_labels == code
+
+        return _pr_curve(records.pred_conf[preds], records.pred_tp[preds], records.label_conf[labels])
+
+    def average_precision(self, iou_threshold=0.5, per_label=False, matching='any'):
+        """
+            Computes the average precision, the area under the interpolated precision/recall curve.
+
+            Parameters
+            ----------
+            iou_threshold : float ::
+                the threshold for overlapping bounding boxes to determine a valid match
+            per_label : bool ::
+                if True, compute the average precision of each ground-truth label separately
+            matching : str ::
+                'any' or 'greedy', see `metrics`
+
+            Returns
+            -------
+            the average precision as a float, or if `per_label` is True, a tuple of the mean
+            average precision (mAP) and a dict of label -> average precision
+        """
+        records = self.match_records(iou_threshold, matching)
+
+        if not per_label:
+            return _average_precision(_pr_curve(records.pred_conf, records.pred_tp, records.label_conf))
+
+        per_label_ap = dict()
+
+        for code in np.unique(records.label_labels):
+            preds = records.pred_labels == code
+            curve = _pr_curve(records.pred_conf[preds], records.pred_tp[preds], records.label_conf[records.label_labels == code])
+            per_label_ap[records.label_names[code]] = _average_precision(curve)
+
+        mean_ap = float(np.mean(list(per_label_ap.values()))) if len(per_label_ap) > 0 else 0.0
+
+        return mean_ap, per_label_ap
+
+    def best_threshold(self, iou_threshold=0.5, matching='any'):
+        """
+            Finds the confidence threshold with the highest fscore.
+
+            Returns
+            -------
+            a tuple of floats for threshold,precision,recall,fscore
+        """
+        curve = self.pr_curve(iou_threshold, matching=matching)
+
+        if len(curve.thresholds) == 0:
+            return None,0.0,0.0,0.0
+
+        best = int(np.argmax(curve.fscore))
+
+        return float(curve.thresholds[best]),float(curve.precision[best]),float(curve.recall[best]),float(curve.fscore[best])
+
+    def _metrics_per_box(self, confidence_threshold, iou_threshold):
+        """The reference implementation of `metrics` that matches one BoundingBox at a time."""
+        true_pos = 0
+        false_pos = 0
+
+        # true_neg = 0 # irrelevant
+        false_neg = 0
+
+        for frame in self.labels:
+            labels = self.labels[frame]
+
+            if frame not in self.predictions:
+                false_neg += len(labels)
+                continue
+            
+            preds = self.predictions[frame]
+
+            f_neg = [False for item in labels]
+            t_pos = []
+            
+            for pred in preds:
+                if pred.confidence == None or float(pred.confidence) >= confidence_threshold:
+                    matches = pred.matches(labels, threshold=iou_threshold)
+                    t_pos.append(True in matches)
+
+                    f_neg = [f_n or matches[i] for i,f_n in enumerate(f_neg)]
+            
+            for item in f_neg:
+                if item == False: false_neg += 1
+            
+            for item in t_pos:
+                if item == True: true_pos += 1
+                else: false_pos += 1
+
+        return _scores(true_pos, false_pos, false_neg)
+
+    def load_labels_from_annot_dict(self, annot_dict):
+        """
+            Only for use with annotation dict of form:
+            {
+            'frame_id': {
+                'label': [
+                    (x,y,w,h)
+                    ]
+                }
+            }
+
+            where the list of boxes of a label may also be an (N, 4) array. The boxes of each label
+            are converted as one array, and columnar labels are filled without creating any `BoundingBox`.
+        """
+
+        internal_dict = self._new_store()
+
+        frame_ids, object_labels, counts, boxes = [], [], [], []
+
+        for frame in annot_dict:
+            if isinstance(internal_dict, BoundingBoxColumns):
+                internal_dict._intern_frame(frame)
+            elif frame not in internal_dict:
+                internal_dict[frame] = []
+
+            for label in annot_dict[frame]:
+                xywh = np.asarray(annot_dict[frame][label], dtype=np.float64).reshape(-1, 4)
+
+                frame_ids.append(frame)
+                object_labels.append(label)
+                counts.append(len(xywh))
+                boxes.append(xywh)
+
+        coords = _xywh_to_corners(np.concatenate(boxes) if len(boxes) > 0 else np.empty((0, 4)))
+
+        if isinstance(internal_dict, BoundingBoxColumns):
+            internal_dict.extend_runs(frame_ids, object_labels, counts, coords)
+        else:
+            start = 0
+
+            for frame,label,count in zip(frame_ids, object_labels, counts):
+                internal_dict[frame] += [BoundingBox(frame, label, (tlx,tly), (brx,bry)) for tlx,tly,brx,bry in coords[start:start + count].tolist()]
+                start += count
+
+        self.labels = internal_dict
+
+    def labels_to_annot_dict(self, as_arrays=False):
+        """
+            Returns the labels as an annotation dict, see `load_labels_from_annot_dict`.
+
+            Parameters
+            ----------
+            as_arrays : bool ::
+                if True, the boxes of each label are an (N, 4) array of (x,y,w,h) rows
+                rather than a list of tuples
+        """
+        annot_dict = dict()
+
+        if not as_arrays and not isinstance(self.labels, BoundingBoxColumns):
+            # the boxes are objects already, so building tuples directly is cheapest
+            for frame in self.labels:
+                annot_dict[frame] = dict()
+
+                for bb in self.labels[frame]:
+                    if bb.label not in annot_dict[frame]:
+                        annot_dict[frame][bb.label] = []
+
+                    val = bb.tlx, bb.tly, bb.brx - bb.tlx, bb.bry - bb.tly
+                    annot_dict[frame][bb.label].append(val)
+
+            return annot_dict
+
+        vocab = dict()
+        read = _frame_reader(self.labels, vocab)
+
+        for frame in self.labels:
+            coords, codes, _ = read(frame)
+            names = list(vocab)
+
+            # group the rows of each label, in order of first appearance
+            order = np.argsort(codes, kind='stable')
+            uniques, starts = np.unique(codes[order], return_index=True)
+            xywh = _corners_to_xywh(coords[order])
+
+            groups = np.split(xywh, starts[1:])
+            firsts = order[starts]
+
+            annot_dict[frame] = dict()
+
+            for i in np.argsort(firsts, kind='stable'):
+                annot_dict[frame][names[uniques[i]]] = groups[i] if as_arrays else list(map(tuple, groups[i].tolist()))
+
+        return annot_dict
+
+    def add_disjoint_boxes(self, num_boxes_to_add, label, max_width, max_height, verbose=False, min_width=10, min_height=10, max_size=None, cell_size=1,
+        seed=None, workers=None):
+        """
+            Adds up to `num_boxes_to_add` labels of `label` to every frame that overlap no label of the frame,
+            see `BoundingBoxArray.add_disjoint_boxes`.
+
+            Parameters
+            ----------
+            num_boxes_to_add : int ::
+                the number of boxes to try to add to each frame
+            label : str ::
+                the label of the added boxes
+            max_width, max_height : int ::
+                the size of a frame
+            verbose : bool ::
+                print every added box
+            min_width, min_height, max_size, cell_size ::
+                see `BoundingBoxArray`
+            seed : int ::
+                if given, each frame is sampled with its own generator seeded from `seed` and the frame_id,
+                so the boxes are reproducible and independent of the number of workers
+            workers : int ::
+                if greater than 1, frames are sampled across a pool of `workers` processes. A seed is drawn
+                from the `random` module if none is given
+        """
+        parallel = workers is not None and workers > 1
+
+        if parallel and seed is None:
+            seed = random.getrandbits(64)
+
+        frames = list(self.labels)
+        args = (max_width, max_height, cell_size, num_boxes_to_add, min_width, min_height, max_size)
+        jobs = [(list(self.labels[frame]), _frame_seed(seed, frame)) + args for frame in frames]
+
+        if parallel:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_disjoint_boxes, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+        else:
+            results = map(_disjoint_boxes, jobs)
+
+        bb_to_add = []
+
+        for frame,to_add in zip(frames, results):
+            bb_to_add += [BoundingBox(frame, label, tl, br) for tl,br in to_add]
+
+        # added after the loop so that columnar labels are only regrouped once
+        for bb in bb_to_add:
+            if verbose: print('Added new bounding box of label {} to frame {} with coords {} and {}'.format(label, bb.frame_id, bb.top_left, bb.bottom_right))
+            self._append_bounding_box(bb, self.labels)
+
+def _xywh_to_corners(boxes):
+    """Converts (N, 4) rows of (x, y, w, h) into rows of (tlx, tly, brx, bry)."""
+    corners = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    corners[:, 2:] += corners[:, :2]
+
+    return corners
+
+def _corners_to_xywh(coords):
+    """Converts (N, 4) rows of (tlx, tly, brx, bry) into rows of (x, y, w, h)."""
+    xywh = np.array(coords, dtype=np.float64).reshape(-1, 4)
+    xywh[:, 2:] -= xywh[:, :2]
+
+    return xywh
+
+def _frame_seed(seed, frame_id):
+    """Returns the seed of one frame derived from a master `seed`, which is stable across processes and runs, or None."""
+    if seed is None:
+        return None
+
+    digest = hashlib.blake2b('{!r}/{!r}'.format(seed, frame_id).encode(), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'little')
+
+def _disjoint_boxes(job):
+    """Samples the disjoint boxes of one frame for `Detection.add_disjoint_boxes`, in this or a worker process."""
+    bb_list, seed, max_width, max_height, cell_size, num_boxes, min_width, min_height, max_size = job
+
+    rng = random if seed is None else random.Random(seed)
+    bba = BoundingBoxArray(bb_list, max_width=max_width, max_height=max_height, cell_size=cell_size)
+
+    return bba.add_disjoint_boxes(num_boxes, min_width=min_width, min_height=min_height, max_size=max_size, rng=rng)
+
+def _partition_csv(filepath, directory, num_buckets, delimiter, line_delimiter, chunk_size):
+    """Splits the rows of a csv file into `num_buckets` files in `directory` by a stable hash of their frame_id."""
+    buckets = [open(os.path.join(directory, '{}.csv'.format(i)), 'w') for i in range(num_buckets)]
+
+    try:
+        for lines in _read_lines(filepath, line_delimiter, chunk_size):
+            rows = [[] for _ in range(num_buckets)]
+
+            for line in lines:
+                frame_id = line.split(delimiter, 1)[0].strip()
+
+                if frame_id == line.strip(): continue # not a row
+
+                rows[zlib.crc32(frame_id.encode()) % num_buckets].append(line)
+
+            for bucket,bucket_rows in zip(buckets, rows):
+                if len(bucket_rows) > 0:
+                    bucket.write(line_delimiter.join(bucket_rows) + line_delimiter)
+    finally:
+        for bucket in buckets:
+            bucket.close()
+
+def _bucket_records(label_filepath, pred_filepath, iou_thresholds, matching, num_buckets, tmp_dir, delimiter,
+    line_delimiter, chunk_size, dtype):
+    """Splits both csv files into `num_buckets` buckets by frame_id and yields the `MatchRecords` of each bucket in turn."""
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        for name,filepath in [('labels', label_filepath), ('predictions', pred_filepath)]:
+            os.mkdir(os.path.join(directory, name))
+            _partition_csv(filepath, os.path.join(directory, name), num_buckets, delimiter, line_delimiter, chunk_size)
+
+        for i in range(num_buckets):
+            det = Detection(columnar=True, dtype=dtype)
+            det.from_csv(label_filepath=os.path.join(directory, 'labels', '{}.csv'.format(i)),
+                pred_filepath=os.path.join(directory, 'predictions', '{}.csv'.format(i)),
+                delimiter=delimiter, line_delimiter=line_delimiter, chunk_size=chunk_size)
+
+            if len(det.labels) == 0: continue
+
+            yield det._match_records(iou_thresholds, matching)
+
+def out_of_core_metrics(label_filepath, pred_filepath, confidence_thresholds=(0.5,), iou_thresholds=(0.5,), matching='any',
+    num_buckets=64, tmp_dir=None, delimiter=',', line_delimiter='\n', chunk_size=1 << 20, dtype=np.float64):
+    """
+        Evaluates label and prediction csv files (see `Detection.from_csv`) that are too large to load at once.
+
+        Both files are first split into `num_buckets` files by frame_id, so that every frame ends up whole
+        in one bucket. The buckets are then evaluated one at a time and their counts summed, so memory is
+        bounded by the size of a bucket rather than of the dataset. Only the given thresholds are kept, see
+        `out_of_core_pr_curve` for the full curve and the average precision.
+
+        Parameters
+        ----------
+        label_filepath, pred_filepath : str :
+            the csv files of the ground truth labels and of the predictions
+        confidence_thresholds, iou_thresholds : iterable of float :
+            the thresholds to evaluate, see `Detection.metrics_grid`
+        matching : str :
+            'any' or 'greedy', see `Detection.metrics`
+        num_buckets : int :
+            how many parts to split the data into; more buckets use less memory
+        tmp_dir : str or None :
+            where to write the buckets, by default the system temporary directory
+
+        Returns
+        -------
+        a `MetricsGrid`, so that e.g. `grid.precision[0, 0]` is the precision at the first thresholds
+    """
+    iou_thresholds = np.asarray(iou_thresholds, dtype=np.float64).reshape(-1)
+    confidence_thresholds = np.asarray(confidence_thresholds, dtype=np.float64).reshape(-1)
+
+    totals = np.zeros((3, len(iou_thresholds), len(confidence_thresholds)), dtype=np.int64)
+
+    for records in _bucket_records(label_filepath, pred_filepath, iou_thresholds, matching, num_buckets, tmp_dir,
+        delimiter, line_delimiter, chunk_size, dtype):
+        for j in range(len(iou_thresholds)):
+            counts = _counts_at(records.pred_conf, records.pred_tp[j], records.label_conf[j], confidence_thresholds)
+            totals[:, j] += counts
+
+    precision, recall, fscore = _score_arrays(*totals)
+
+    return MetricsGrid(iou_thresholds, confidence_thresholds, precision, recall, fscore)
+
+def out_of_core_pr_curve(label_filepath, pred_filepath, iou_threshold=0.5, matching='any', num_buckets=64, tmp_dir=None,
+    delimiter=',', line_delimiter='\n', chunk_size=1 << 20, dtype=np.float64):
+    """
+        Computes the `PRCurve` and the average precision of csv files that are too large to load at once.
+
+        The files are split into buckets as in `out_of_core_metrics`. Of each bucket only a histogram of the
+        confidences is kept, the number of predictions and true positives at every distinct prediction confidence
+        and the number of labels at every distinct best matching confidence, and the histograms are merged as
+        the buckets are evaluated. Memory is bounded by the size of a bucket plus the number of distinct
+        confidences, which is small when confidences are rounded.
+
+        Parameters
+        ----------
+        label_filepath, pred_filepath : str :
+            the csv files of the ground truth labels and of the predictions
+        iou_threshold : float :
+            the threshold for overlapping bounding boxes to determine a valid match
+        matching : str :
+            'any' or 'greedy', see `Detection.metrics`
+        num_buckets : int :
+            how many parts to split the data into; more buckets use less memory
+        tmp_dir : str or None :
+            where to write the buckets, by default the system temporary directory
+
+        Returns
+        -------
+        a tuple of the `PRCurve` and the average precision, as `Detection.pr_curve` and `Detection.average_precision`
+    """
+    pred_hist = (np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+    label_hist = (np.empty(0), np.empty(0, dtype=np.int64))
+
+    iou_thresholds = np.array([iou_threshold], dtype=np.float64)
+
+    for records in _bucket_records(label_filepath, pred_filepath, iou_thresholds, matching, num_buckets, tmp_dir,
+        delimiter, line_delimiter, chunk_size, dtype):
+        pred_hist = _histogram(np.concatenate([pred_hist[0], records.pred_conf]), np.concatenate([pred_hist[1], records.pred_tp[0]]),
+            np.concatenate([pred_hist[2], np.ones(len(records.pred_conf), dtype=np.int64)]))
+        label_hist = _histogram(np.concatenate([label_hist[0], records.label_conf[0]]),
+            np.concatenate([label_hist[1], np.ones(records.label_conf.shape[1], dtype=np.int64)]))
+
+    # the histograms are sorted, so the distinct confidences are the curve's thresholds
+    thresholds = pred_hist[0][::-1]
+    counts = _histogram_counts_at(*pred_hist, *label_hist, thresholds)
+    curve = PRCurve(thresholds, *_score_arrays(*counts))
+
+    return curve, _average_precision(curve)
+
+class IncrementalEvaluator():
+    """
+        Online metrics for a `Detection` that is being streamed into.
+
+        Keeps the match records and TP/FP/FN counts of every frame, and when boxes are added only
+        the frames that changed are matched again, so a query costs O(changed frames) rather
+        than a full evaluation. Create one with `Detection.track_metrics`.
+    """
+
+    def __init__(self, detection, confidence_threshold=0.5, iou_threshold=0.5):
+        self.detection = detection
+        self.confidence_threshold = confidence_threshold
+        self.iou_threshold = iou_threshold
+
+        self._reset()
+
+    def _reset(self):
+        self._labels = self.detection.labels
+        self._predictions = self.detection.predictions
+
+        self._vocab = self.detection._vocab
+        self._frames = dict() # frame_id -> (counts, pred_conf, pred_tp, pred_codes, label_conf, label_codes)
+        self._dirty = set(self._labels) if self._labels is not None else set()
+        self.counts = [0, 0, 0]
+
+    def touch(self, frame_id):
+        """Mark `frame_id` as changed."""
+        self._dirty.add(frame_id)
+
+    def _refresh(self):
+        """Re-match every changed frame and update the running counts."""
+        det = self.detection
+
+        # labels or predictions were replaced wholesale, e.g. by `from_csv`
+        if det.labels is not self._labels or det.predictions is not self._predictions:
+            self._reset()
+
+        if det.labels is None:
+            raise RuntimeError('There are no labels associated with this detection!')
+        if det.predictions is None:
+            raise RuntimeError('There are no predictions associated with this detection!')
+
+        for frame in self._dirty:
+            old = self._frames.pop(frame, None)
+
+            if old is not None:
+                self.counts = [total - count for total,count in zip(self.counts, old[0])]
+
+            if frame not in det.labels: continue
+
+            label_boxes, label_codes, _ = _frame_reader(det.labels, self._vocab)(frame)
+
+            if frame in det.predictions:
+                pred_boxes, pred_codes, pred_conf = _frame_reader(det.predictions, self._vocab)(frame)
+            else:
+                pred_boxes, pred_codes, pred_conf = np.empty((0, 4)), np.empty(0, dtype=np.int64), np.empty(0)
+
+            pred_conf = np.where(np.isnan(pred_conf), np.inf, pred_conf)
+
+            pairs = related_pairs(pred_boxes, pred_codes, label_boxes, label_codes)
+            pred_tp, label_conf = _frame_records(pred_conf, pairs, len(label_boxes), np.array([self.iou_threshold], dtype=np.float64))
+
+            counts = [int(count[0]) for count in _counts_at(pred_conf, pred_tp[0], label_conf[0], [self.confidence_threshold])]
+
+            self._frames[frame] = (counts, pred_conf, pred_tp[0], pred_codes, label_conf[0], label_codes)
+            self.counts = [total + count for total,count in zip(self.counts, counts)]
+
+        self._dirty.clear()
+
+    def metrics(self):
+        """
+            Returns
+            -------
+            a tuple of floats for precision,recall,fscore, the same as `Detection.metrics`
+        """
+        self._refresh()
+
+        return _scores(*self.counts)
+
+    def match_records(self):
+        """Returns the `MatchRecords` of every frame with labels, from the cached frame state."""
+        self._refresh()
+
+        frames = list(self._frames.values())
+
+        def join(i, dtype):
+            return np.concatenate([frame[i] for frame in frames]).astype(dtype, copy=False) if len(frames) > 0 else np.empty(0, dtype=dtype)
+
+        return MatchRecords(join(1, np.float64), join(2, bool), join(3, np.int64), join(4, np.float64), join(5, np.int64), list(self._vocab))
+
+    def pr_curve(self):
+        """Returns the `PRCurve` of everything streamed so far, see `Detection.pr_curve`."""
+        records = self.match_records()
+
+        return _pr_curve(records.pred_conf, records.pred_tp, records.label_conf)
+
+    def average_precision(self):
+        """Returns the average precision of everything streamed so far, see `Detection.average_precision`."""
+        return _average_precision(self.pr_curve())
+
+class BoundingBoxArray():
+    """
+        A two-dimensional occupancy grid of bounding boxes.
+
+        Parameters
+        ----------
+        bounding_box_list : list<BoundingBox> ::
+            the boxes that occupy the grid
+        max_width, max_height : int ::
+            the size of the frame, the extent of the boxes by default. Frames of size at most 1 hold
+            normalized boxes and are scaled by 1000
+        cell_size : int ::
+            the width and height of a grid cell, in (scaled) frame units. A box occupies every cell it touches,
+            so a coarser grid uses cell_size ** 2 times less memory at the cost of some free space near boxes
+    """
+
+    def __init__(self, bounding_box_list, max_width=None, max_height=None, cell_size=1):
+        self.list = bounding_box_list
+        self.cell_size = cell_size
+        
+        if max_width == None:
+            self.width = int(max([bb.brx for bb in bounding_box_list]))
+        else:
+            self.width = max_width
+
+        if max_height == None:
+            self.height = int(max([bb.bry for bb in bounding_box_list]))
+        else:
+            self.height = max_height
+
+        if self.width <= 1 or self.height <= 1:
+            self.width = int(self.width * 1000)
+            self.height = int(self.height * 1000)
+            self.normalized = True
+        else:
+            self.normalized = False
+        
+        self.scale = 1000 if self.normalized else 1
+
+        # 0 is free, 1 is a bounding box and 2 is an added disjoint box. Only whole cells fit in the frame
+        self.array = np.zeros((self.height // cell_size, self.width // cell_size), dtype=np.uint8)
+
+        for bb in bounding_box_list:
+            self._add_bounding_box_to_array(bb)
+    
+    def _add_bounding_box_to_array(self, bb):
+        scale = self.scale / self.cell_size
+
+        tlx = int(np.floor(bb.tlx * scale))
+        tly = int(np.floor(bb.tly * scale))
+        brx = int(np.ceil(bb.brx * scale))
+        bry = int(np.ceil(bb.bry * scale))
+
+        self.array[max(tly, 0):max(bry, 0), max(tlx, 0):max(brx, 0)] = 1
+
+    def _add_disjoint_bounding_box(self, free_space, min_size=(10,10), max_size=None, tries=10, rng=random):
+        """
+            Tries to add a new non-overlapping bounding box. Returns its ((tlx, tly), (brx, bry)) if successful, False if not.
+
+            A top left corner is drawn from the cells where a box of `min_size` fits, first by `tries` random guesses
+            and then from all such cells. The box is then grown to a random width and height, up to `max_size` and
+            the largest free extents found by binary search.
+        """
+        if max_size is not None and (max_size[0] < min_size[0] or max_size[1] < min_size[1]):
+            raise RuntimeError('max_size {} is smaller than the minimum size {}!'.format(tuple(max_size), tuple(min_size)))
+
+        # sizes in frame units to sizes in cells, rounding towards boxes that satisfy both bounds
+        min_width, min_height = [max(-(-size // self.cell_size), 1) for size in min_size]
+        max_width, max_height = [size // self.cell_size for size in max_size] if max_size is not None else self.array.shape[::-1]
+
+        if max_size is not None and (min_width > max_width or min_height > max_height):
+            raise RuntimeError('No whole number of {} unit cells fits between the minimum size {} and max_size {}!'.format(
+                self.cell_size, tuple(min_size), tuple(max_size)))
+
+        corner = free_space.sample(min_width, min_height, tries, rng)
+
+        if corner is None: return False
+
+        tlx, tly = corner
+
+        brx = tlx + rng.randint(min_width, free_space.widest(tlx, tly, min_height, max_width))
+        bry = tly + rng.randint(min_height, free_space.tallest(tlx, tly, brx - tlx, max_height))
+
+        free_space.place(tlx, tly, brx, bry)
+        self.array[tly:bry, tlx:brx] = 2
+
+        cell = self.cell_size
+
+        return (tlx * cell, tly * cell),(brx * cell, bry * cell)
+
+    def add_disjoint_boxes(self, num_boxes, label='background', min_width=10, min_height=10, tries=10, max_size=None, rng=random):
+        """
+            Adds up to `num_boxes` boxes that overlap neither the bounding boxes of the array nor each other.
+
+            Parameters
+            ----------
+            num_boxes : int ::
+                the number of boxes to try to add
+            label : str ::
+                unused, kept for compatibility
+            min_width, min_height : int ::
+                the minimum size of a box, in (scaled) frame units
+            tries : int ::
+                the number of random guesses at a free corner before all free corners are searched
+            max_size : (int, int) ::
+                the maximum (width, height) of a box, in (scaled) frame units. Boxes grow up to the free space by default
+            rng : random.Random ::
+                the source of randomness, the global `random` module by default
+
+            Returns
+            -------
+            a list of ((tlx, tly), (brx, bry)) tuples of the added boxes
+        """
+        free_space = _FreeSpace(self.array, num_boxes)
+
+        added = []
+        for i in range(num_boxes):
+            res = self._add_disjoint_bounding_box(free_space, min_size=(min_width,min_height), max_size=max_size, tries=tries, rng=rng)
+
+            if res == False: break # no free space is left for a box of the minimum size
+
+            if self.normalized:
+                tl,br = res
+                tl = tl[0] / 1000, tl[1] / 1000
+                br = br[0] / 1000, br[1] / 1000
+                res = tl,br
+            added.append(res)
+        
+        return added
+
+class _FreeSpace():
+    """
+        The free cells of an occupancy array, answering "is this rectangle free?" in constant time
+        through a summed-area table, plus a check against the boxes placed since it was built.
+    """
+
+    def __init__(self, array, capacity):
+        self.height, self.width = array.shape
+
+        # table[y, x] is the number of occupied cells in array[:y, :x]
+        dtype = np.int32 if array.size < 2 ** 31 else np.int64
+        self.table = np.zeros((self.height + 1, self.width + 1), dtype=dtype)
+        np.cumsum(np.cumsum(array != 0, axis=0, dtype=dtype), axis=1, out=self.table[1:, 1:])
+
+        self.placed = np.empty((max(capacity, 1), 4), dtype=np.int64)
+        self.num_placed = 0
+        self.corners = {}
+
+    def is_free(self, tlx, tly, brx, bry):
+        """Returns True if no cell in [tly, bry) x [tlx, brx) is occupied or covered by a placed box."""
+        table = self.table
+
+        if table[bry, brx] - table[tly, brx] - table[bry, tlx] + table[tly, tlx] != 0:
+            return False
+
+        placed = self.placed[:self.num_placed]
+
+        return not np.any((placed[:, 0] < brx) & (tlx < placed[:, 2]) & (placed[:, 1] < bry) & (tly < placed[:, 3]))
+
+    def _corners(self, width, height):
+        """Returns a boolean array of the (tly, tlx) corners where a free `width` x `height` box fits."""
+        if (width, height) not in self.corners:
+            table = self.table
+            occupied = table[height:, width:] - table[:-height, width:] - table[height:, :-width] + table[:-height, :-width]
+            corners = occupied == 0
+
+            for tlx, tly, brx, bry in self.placed[:self.num_placed]:
+                corners[max(tly - height + 1, 0):bry, max(tlx - width + 1, 0):brx] = False
+
+            self.corners[(width, height)] = corners
+
+        return self.corners[(width, height)]
+
+    def sample(self, width, height, tries=10, rng=random):
+        """Returns a random (tlx, tly) corner where a free `width` x `height` box fits, or None if there is none."""
+        if width < 1 or height < 1 or width > self.width or height > self.height:
+            return None
+
+        corners = self._corners(width, height)
+        rows, cols = corners.shape
+
+        for _ in range(tries):
+            tly, tlx = rng.randrange(rows), rng.randrange(cols)
+
+            if corners[tly, tlx]:
+                return tlx, tly
+
+        free = np.flatnonzero(corners)
+
+        if len(free) == 0:
+            return None
+
+        tly, tlx = divmod(int(free[rng.randrange(len(free))]), cols)
+
+        return tlx, tly
+
+    def widest(self, tlx, tly, height, limit):
+        """Returns the largest width, up to `limit`, of a free box of `height` with its top left corner at (tlx, tly)."""
+        return _largest(lambda width: self.is_free(tlx, tly, tlx + width, tly + height), 0, min(limit, self.width - tlx))
+
+    def tallest(self, tlx, tly, width, limit):
+        """Returns the largest height, up to `limit`, of a free box of `width` with its top left corner at (tlx, tly)."""
+        return _largest(lambda height: self.is_free(tlx, tly, tlx + width, tly + height), 0, min(limit, self.height - tly))
+
+    def place(self, tlx, tly, brx, bry):
+        """Marks the box [tly, bry) x [tlx, brx) as occupied."""
+        if self.num_placed == len(self.placed):
+            self.placed = np.concatenate([self.placed, np.empty_like(self.placed)])
+
+        self.placed[self.num_placed] = tlx, tly, brx, bry
+        self.num_placed += 1
+
+        for (width, height), corners in self.corners.items():
+            corners[max(tly - height + 1, 0):bry, max(tlx - width + 1, 0):brx] = False
+
+def _largest(fits, lo, hi):
+    """Returns the largest value in [lo, hi] for which `fits` is True, where `fits(lo)` is True and `fits` is monotone."""
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+
+        if fits(mid):
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
 
 if __name__ == "__main__":
     a = BoundingBox('','',(0,0), (5,5))
@@ -1,5 +1,48 @@
 import unittest
-from detection import Detection,BoundingBox
+from unittest import mock
+import json
+import os
+import random
+import tempfile
+import numpy as np
+
+try:
+    import scipy
+except ImportError:
+    scipy = None
+from detection import Detection,BoundingBox,BoundingBoxArray,BoundingBoxColumns,LabelIndex,ParseCache,out_of_core_metrics,out_of_core_pr_curve,pairwise_iou,related_iou
+
+def random_detection(num_frames=20, boxes_per_frame=15, labels='AB', seed=0, columnar=False):
+    """Builds a Detection of random, heavily overlapping boxes for comparing evaluation paths."""
+    rand = random.Random(seed)
+
+    def box(frame):
+        tlx, tly = rand.randint(0, 50), rand.randint(0, 50)
+        return frame, rand.choice(labels), (tlx, tly), (tlx + rand.randint(1, 30), tly + rand.randint(1, 30))
+
+    det = Detection(columnar=columnar)
+
+    for frame in range(num_frames):
+        for _ in range(boxes_per_frame):
+            det.add_label(BoundingBox(*box(frame)))
+            det.add_prediction(BoundingBox(*box(frame), confidence=rand.random()))
+
+    return det
+
+def write_csv(det, directory):
+    """Writes the labels and predictions of `det` to `directory` in the `Detection.from_csv` format and returns their paths."""
+    paths = []
+
+    for name in ['labels', 'predictions']:
+        paths.append(os.path.join(directory, name + '.csv'))
+
+        with open(paths[-1], 'w') as f:
+            for frame in getattr(det, name):
+                for bb in getattr(det, name)[frame]:
+                    row = [frame, bb.label, bb.tlx, bb.tly, bb.brx, bb.bry] + ([bb.confidence] if bb.confidence is not None else [])
+                    f.write(', '.join(str(item) for item in row) + '\n')
+
+    return paths
 
 class TestDetection(unittest.TestCase):
 
@@ -70,6 +113,19 @@ class TestDetection(unittest.TestCase):
         self.assertEqual(r1.iou(r2), 0.25 / 1.75)
         self.assertEqual(r1.iou(r2), r2.iou(r1))
 
+    def test_bounding_box_immutable_and_hashable(self):
+        r1 = BoundingBox(1, 'A', (0,1), (5,3), 0.5)
+
+        self.assertEqual(r1.top_left, (0.0, 1.0))
+        self.assertEqual((r1.width, r1.height, r1.area), (5.0, 2.0, 10.0))
+        self.assertEqual(len({r1, BoundingBox(1, 'A', (0.0,1.0), (5,3), 0.5)}), 1)
+
+        with self.assertRaises(AttributeError):
+            r1.tlx = 2
+
+        with self.assertRaises(AttributeError):
+            r1.other = 2
+
     def test_precision_one_class(self):
         # [2 2 10 20; 80 80 30 40]
         true1 = BoundingBox(1, 'A', (2,2), (12,22))
@@ -182,7 +238,533 @@ class TestDetection(unittest.TestCase):
         self.assertEqual(pr, 2.0 / 3.0)
         self.assertEqual(re, 1.000)
 
+    def test_pairwise_iou_matches_bounding_box_iou(self):
+        boxes = [BoundingBox('', '', (0,0), (1,1)), BoundingBox('', '', (0.5,0.5), (1.5,1.5)), BoundingBox('', '', (4.5,0), (5.5,6))]
+        coords = np.array([(bb.tlx, bb.tly, bb.brx, bb.bry) for bb in boxes])
+
+        ious = pairwise_iou(coords, coords)
+
+        for i, a in enumerate(boxes):
+            for j, b in enumerate(boxes):
+                self.assertEqual(ious[i, j], a.iou(b))
+
+    def test_metrics_vectorized_matches_per_box(self):
+        det = random_detection()
+
+        for confidence_threshold in [0.0, 0.3, 0.7]:
+            for iou_threshold in [0.1, 0.5, 0.9]:
+                self.assertEqual(det.metrics(confidence_threshold, iou_threshold),
+                    det.metrics(confidence_threshold, iou_threshold, vectorized=False))
+
+    def test_columnar_metrics_match_dict(self):
+        det = random_detection()
+        columnar = random_detection(columnar=True)
+
+        self.assertIsInstance(columnar.labels, BoundingBoxColumns)
+
+        for confidence_threshold in [0.0, 0.5]:
+            self.assertEqual(det.metrics(confidence_threshold), columnar.metrics(confidence_threshold))
+
+    def test_columnar_views(self):
+        columns = BoundingBoxColumns()
+        columns.append(BoundingBox(2, 'A', (0,0), (1,1)))
+        columns.append(BoundingBox(1, 'B', (1,2), (3,4), confidence=0.25))
+        columns.append(BoundingBox(2, 'B', (5,5), (6,6)))
+
+        self.assertEqual(list(columns), [2, 1])
+        self.assertEqual(list(columns[2]), [BoundingBox(2, 'A', (0,0), (1,1)), BoundingBox(2, 'B', (5,5), (6,6))])
+        self.assertEqual(list(columns[1]), [BoundingBox(1, 'B', (1,2), (3,4), confidence=0.25)])
+        self.assertNotIn(3, columns)
+
+        with self.assertRaises(AttributeError):
+            columns[2].append(BoundingBox(2, 'A', (0,0), (1,1)))
+
+    def test_columnar_from_csv(self):
+        det = Detection()
+        det.from_csv(label_filepath='example/labels.csv', pred_filepath='example/preds.csv')
+
+        columnar = Detection(columnar=True, dtype=np.float32)
+        columnar.from_csv(label_filepath='example/labels.csv', pred_filepath='example/preds.csv')
+
+        self.assertEqual(det.metrics(), columnar.metrics())
+        self.assertEqual(columnar.labels.coords.dtype, np.float32)
+
+    def test_from_csv_chunked(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'preds.csv')
+
+            with open(path, 'w') as f:
+                f.write('1, A, 0, 0, 10, 10, 0.9\n2, B, 1.5, 2, 3, 4\n1, A, 5, 5, 20, 20, 0.25\n')
+
+            for columnar in [False, True]:
+                for chunk_size in [3, 1 << 20]:
+                    det = Detection(columnar=columnar)
+                    det.from_csv(pred_filepath=path, chunk_size=chunk_size)
+
+                    self.assertEqual(list(det.predictions), ['1', '2'])
+                    self.assertEqual(list(det.predictions['1']), [BoundingBox('1', 'A', (0,0), (10,10), 0.9), BoundingBox('1', 'A', (5,5), (20,20), 0.25)])
+                    self.assertEqual(list(det.predictions['2']), [BoundingBox('2', 'B', (1.5,2), (3,4))])
+
+    def test_pr_curve_matches_metrics(self):
+        det = random_detection()
+        curve = det.pr_curve(iou_threshold=0.3)
+
+        self.assertTrue(np.all(np.diff(curve.thresholds) < 0))
+
+        for i in range(0, len(curve.thresholds), 17):
+            pr,re,fs = det.metrics(confidence_threshold=curve.thresholds[i], iou_threshold=0.3)
+
+            self.assertAlmostEqual(curve.precision[i], pr)
+            self.assertAlmostEqual(curve.recall[i], re)
+            self.assertAlmostEqual(curve.fscore[i], fs)
+
+    def test_average_precision(self):
+        det = Detection()
+
+        det.add_label(1, 'A', 0, 0, 10, 10)
+        det.add_label(1, 'B', 20, 20, 30, 30)
+        det.add_prediction(1, 'A', 0, 0, 10, 10, 0.9)
+        det.add_prediction(1, 'A', 50, 50, 60, 60, 0.8)
+        det.add_prediction(1, 'B', 20, 20, 30, 30, 0.3)
+
+        # thresholds 0.9, 0.8, 0.3: (p, r) = (1, 1/2), (1/2, 1/2), (2/3, 1)
+        self.assertAlmostEqual(det.average_precision(), 0.5 * 1.0 + 0.5 * (2.0 / 3.0))
+
+        mean_ap, per_label = det.average_precision(per_label=True)
+
+        self.assertEqual(per_label, {'A': 1.0, 'B': 1.0})
+        self.assertEqual(mean_ap, 1.0)
+
+        threshold,pr,re,_ = det.best_threshold()
+
+        self.assertEqual(threshold, 0.3)
+        self.assertEqual((pr, re), det.metrics(confidence_threshold=0.3)[:2])
+
+    def test_metrics_grid_matches_metrics(self):
+        det = random_detection(columnar=True)
+        grid = det.metrics_grid(confidence_thresholds=[0.0, 0.25, 0.8])
+
+        self.assertEqual(grid.precision.shape, (10, 3))
+
+        for i,iou_threshold in enumerate(grid.iou_thresholds):
+            for j,confidence_threshold in enumerate(grid.confidence_thresholds):
+                pr,re,fs = det.metrics(confidence_threshold, iou_threshold)
+
+                self.assertAlmostEqual(grid.precision[i, j], pr)
+                self.assertAlmostEqual(grid.recall[i, j], re)
+                self.assertAlmostEqual(grid.fscore[i, j], fs)
+
+    def test_metrics_parallel_matches_serial(self):
+        det = random_detection()
+
+        self.assertEqual(det.metrics(0.3, workers=2), det.metrics(0.3))
+
+        # many more shards than are kept in flight
+        with mock.patch('detection._MAX_SHARD_FRAMES', 1):
+            self.assertEqual(det.metrics(0.3, workers=2), det.metrics(0.3))
+
+        with self.assertRaises(RuntimeError):
+            det.metrics(0.3, vectorized=False, workers=2)
+
+    def test_incremental_metrics(self):
+        det = Detection()
+        evaluator = det.track_metrics(confidence_threshold=0.3)
+
+        reference = random_detection(num_frames=5)
+
+        for frame in reference.labels:
+            for bb in reference.labels[frame]:
+                det.add_label(bb)
+
+            for bb in reference.predictions[frame]:
+                det.add_prediction(bb)
+
+            self.assertEqual(evaluator.metrics(), det.metrics(confidence_threshold=0.3))
+
+        curve = evaluator.pr_curve()
+        expected = reference.pr_curve()
+
+        np.testing.assert_array_equal(curve.thresholds, expected.thresholds)
+        np.testing.assert_array_equal(curve.precision, expected.precision)
+        self.assertEqual(evaluator.average_precision(), reference.average_precision())
+
+    def test_label_index_candidates(self):
+        rand = np.random.RandomState(0)
+        tl = rand.randint(0, 500, size=(300, 2))
+        boxes = np.hstack([tl, tl + rand.randint(1, 40, size=(300, 2))]).astype(np.float64)
+        labels = rand.randint(0, 3, size=300)
+
+        pred_idx, label_idx = LabelIndex(boxes[:150], labels[:150]).candidates(boxes[150:], labels[150:])
+        expected = np.argwhere(related_iou(boxes[150:], labels[150:], boxes[:150], labels[:150]) > -np.inf)
+
+        self.assertEqual(sorted(zip(pred_idx.tolist(), label_idx.tolist())), sorted(map(tuple, expected.tolist())))
+
+    def test_metrics_large_frame_uses_index(self):
+        det = random_detection(num_frames=2, boxes_per_frame=100)
+
+        self.assertEqual(det.metrics(0.3, 0.3), det.metrics(0.3, 0.3, vectorized=False))
+
+        indexed = [det.metrics(0.3, 0.3, matching=matching) for matching in ['any', 'greedy']]
+
+        # the same frames matched densely
+        with mock.patch('detection._DENSE_PAIR_LIMIT', 10 ** 9):
+            dense = [det.metrics(0.3, 0.3, matching=matching) for matching in ['any', 'greedy']]
+
+        self.assertEqual(indexed, dense)
+
+    def test_metrics_large_frame_changed_in_place(self):
+        det = Detection()
+
+        for i in range(80):
+            det.add_label(1, 'A', (i * 20, 0), (i * 20 + 10, 10))
+            det.add_prediction(1, 'A', (i * 20, 100), (i * 20 + 10, 110), 0.9)
+
+        self.assertEqual(det.metrics(), (0.0, 0.0, 0.0))
+
+        # lists of a dict store can be appended to directly, so large frames are indexed on every call
+        det.labels[1].append(BoundingBox(1, 'A', (0, 200), (10, 210)))
+        det.predictions[1].append(BoundingBox(1, 'A', (0, 200), (10, 210), 0.9))
+
+        self.assertEqual(det.metrics(), det.metrics(vectorized=False))
+        self.assertGreater(det.metrics()[0], 0.0)
+
+    def test_add_arrays(self):
+        det = Detection()
+
+        det.add_labels_array(1, np.array([[2,2,12,22], [80,80,110,120], [20,20,30,30]]), 'A')
+        det.add_predictions_array(1, np.array([[4,4,14,24], [50,50,80,60], [80,80,110,120]]), ['A', 'A', 'B'], np.array([0.9, 0.8, 0.7]))
+
+        self.assertIsInstance(det.predictions, BoundingBoxColumns)
+        self.assertEqual(det.predictions[1][2], BoundingBox(1, 'B', (80,80), (110,120), 0.7))
+
+        pr,re,_ = det.metrics()
+
+        self.assertEqual(pr, 1.0 / 3.0)
+        self.assertEqual(re, 1.0 / 3.0)
+
+    def test_init_from_tuples(self):
+        labels = [(1, 'A', (2,2), (12,22)), (1, 'A', 80, 80, 110, 120), BoundingBox(1, 'A', (20,20),(30,30))]
+        predictions = [(1, 'A', (4,4), (14,24), 0.9), (1, 'A', 50, 50, 80, 60, 0.9), (1, 'B', 80, 80, 110, 120, 0.9)]
+
+        for columnar in [False, True]:
+            det = Detection(labels=labels, predictions=predictions, columnar=columnar)
+
+            self.assertEqual(det.labels[1][1], BoundingBox(1, 'A', (80,80), (110,120)))
+            self.assertEqual(det.predictions[1][0], BoundingBox(1, 'A', (4,4), (14,24), 0.9))
+            self.assertEqual(det.metrics()[:2], (1.0 / 3.0, 1.0 / 3.0))
+
+    def test_save_load(self):
+        det = random_detection()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            det.save(tmp)
+
+            for mmap in [True, False]:
+                loaded = Detection()
+                loaded.load(tmp, mmap=mmap)
+
+                self.assertEqual(list(loaded.labels), list(det.labels))
+                self.assertEqual(list(loaded.labels[3]), list(det.labels[3]))
+                self.assertEqual(list(loaded.predictions[7]), list(det.predictions[7]))
+                self.assertEqual(loaded.metrics(0.3), det.metrics(0.3))
+
+                loaded.add_label(BoundingBox(100, 'C', (0,0), (1,1)))
+
+                self.assertEqual(list(loaded.labels[100]), [BoundingBox(100, 'C', (0,0), (1,1))])
+
+    def test_from_csv_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'labels.csv')
+            cache = ParseCache(os.path.join(tmp, 'cache'))
+
+            with open(path, 'w') as f:
+                f.write('1, A, 0, 0, 10, 10\n')
+
+            for _ in range(2):
+                det = Detection()
+                det.from_csv(label_filepath=path, cache=cache)
+
+                self.assertEqual(list(det.labels['1']), [BoundingBox('1', 'A', (0,0), (10,10))])
+                self.assertEqual(len(os.listdir(cache.directory)), 1)
+
+            with open(path, 'a') as f:
+                f.write('2, B, 0, 0, 5, 5\n')
+
+            det.from_csv(label_filepath=path, cache=cache)
+
+            self.assertEqual(list(det.labels), ['1', '2'])
+            self.assertEqual(len(os.listdir(cache.directory)), 1)
+
+            cache.max_bytes = 0
+            cache.put(cache.key(path), det.labels)
+
+            self.assertEqual(os.listdir(cache.directory), [])
+
+    def test_from_csv_cache_other_version(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'labels.csv')
+            cache = ParseCache(os.path.join(tmp, 'cache'))
+
+            with open(path, 'w') as f:
+                f.write('1, A, 0, 0, 10, 10\n')
+
+            Detection().from_csv(label_filepath=path, cache=cache)
+
+            header_path = os.path.join(cache.directory, cache.key(path), 'header.json')
+
+            with open(header_path) as f:
+                header = json.load(f)
+
+            header['version'] = 2
+
+            with open(header_path, 'w') as f:
+                json.dump(header, f)
+
+            # the entry is a miss, so the file is parsed again and the entry replaced
+            for _ in range(2):
+                det = Detection()
+                det.from_csv(label_filepath=path, cache=cache)
+
+                self.assertEqual(list(det.labels['1']), [BoundingBox('1', 'A', (0,0), (10,10))])
+
+            with open(header_path) as f:
+                self.assertEqual(json.load(f)['version'], 1)
+
+    def test_one_to_one_duplicates(self):
+        det = Detection()
+
+        det.add_label(1, 'A', 0, 0, 10, 10)
+        det.add_prediction(1, 'A', 0, 0, 10, 10, 0.9)
+        det.add_prediction(1, 'A', 0, 0, 10, 11, 0.8)
+
+        self.assertEqual(det.metrics()[:2], (1.0, 1.0))
+        self.assertEqual(det.metrics(matching='greedy')[:2], (0.5, 1.0))
+
+    @unittest.skipIf(scipy is None, 'requires scipy')
+    def test_one_to_one_hungarian(self):
+        det = Detection()
+
+        det.add_label(1, 'A', 0, 0, 10, 10)
+        det.add_label(1, 'A', 2, 0, 12, 10)
+        det.add_prediction(1, 'A', 1.5, 0, 11.5, 10, 0.9)
+        det.add_prediction(1, 'A', 3, 0, 13, 10, 0.8)
+
+        self.assertEqual(det.metrics(iou_threshold=0.6, matching='greedy'), (0.5, 0.5, 0.5))
+        self.assertEqual(det.metrics(iou_threshold=0.6, matching='hungarian'), (1.0, 1.0, 1.0))
+
+    def test_greedy_pr_curve_matches_metrics(self):
+        det = random_detection()
+        curve = det.pr_curve(matching='greedy')
+
+        for i in range(0, len(curve.thresholds), 17):
+            pr,re,fs = det.metrics(confidence_threshold=curve.thresholds[i], matching='greedy')
+
+            self.assertAlmostEqual(curve.precision[i], pr)
+            self.assertAlmostEqual(curve.recall[i], re)
+            self.assertAlmostEqual(curve.fscore[i], fs)
+
+    def test_out_of_core_metrics(self):
+        det = random_detection()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            label_path, pred_path = write_csv(det, tmp)
+
+            grid = out_of_core_metrics(label_path, pred_path, confidence_thresholds=[0.3, 0.6], num_buckets=3, chunk_size=100)
+
+        for j,confidence_threshold in enumerate([0.3, 0.6]):
+            pr,re,fs = det.metrics(confidence_threshold)
+
+            self.assertAlmostEqual(grid.precision[0, j], pr)
+            self.assertAlmostEqual(grid.recall[0, j], re)
+            self.assertAlmostEqual(grid.fscore[0, j], fs)
+
+    def test_out_of_core_pr_curve(self):
+        det = random_detection()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            label_path, pred_path = write_csv(det, tmp)
+
+            curve, ap = out_of_core_pr_curve(label_path, pred_path, num_buckets=3, chunk_size=100)
+
+        expected = det.pr_curve()
+
+        np.testing.assert_allclose(curve.thresholds, expected.thresholds)
+        np.testing.assert_allclose(curve.precision, expected.precision)
+        np.testing.assert_allclose(curve.recall, expected.recall)
+        self.assertAlmostEqual(ap, det.average_precision())
+
+    def test_metrics_report(self):
+        det = random_detection()
+
+        for workers in [None, 2]:
+            pr,re,fs,report = det.metrics(0.4, workers=workers, matching='greedy', report=True)
+
+            self.assertEqual((pr, re, fs), det.metrics(0.4, matching='greedy'))
+            self.assertEqual(sorted(report.labels), ['A', 'B'])
+            self.assertEqual(len(report.frames), len(det.labels))
+
+            for counts in [report.label_counts, report.frame_counts]:
+                totals = [int(counts[field].sum()) for field in ['true_pos', 'false_pos', 'false_neg']]
+                self.assertAlmostEqual(totals[0] / (totals[0] + totals[1]), pr)
+                self.assertAlmostEqual(totals[0] / (totals[0] + totals[2]), re)
+
+    def test_worst_frames(self):
+        det = Detection()
+        det.add_label('f0', 'A', (0, 0), (10, 10))
+        det.add_prediction('f0', 'A', (0, 0), (10, 10), 0.9)
+        det.add_label('f1', 'A', (0, 0), (10, 10))
+        det.add_prediction('f1', 'A', (50, 50), (60, 60), 0.9)
+
+        _,_,_,report = det.metrics(report=True)
+        (frame, counts), _ = report.worst_frames()
+
+        self.assertEqual(frame, 'f1')
+        self.assertEqual((counts['false_pos'], counts['false_neg']), (1, 1))
+        self.assertEqual(report.label_metrics()['A'], (0.5, 0.5, 0.5))
+
+    def test_add_disjoint_boxes(self):
+        random.seed(0)
+        det = random_detection(num_frames=3, boxes_per_frame=10)
+        before = {frame: len(det.labels[frame]) for frame in det.labels}
+
+        det.add_disjoint_boxes(50, 'background', 200, 200, max_size=(30, 30))
+
+        for frame in det.labels:
+            boxes = np.array([[bb.tlx, bb.tly, bb.brx, bb.bry] for bb in det.labels[frame]])
+            added = boxes[before[frame]:]
+
+            self.assertEqual(len(added), 50)
+            self.assertTrue(np.all(added[:, 2:] - added[:, :2] >= 10))
+            self.assertTrue(np.all(added[:, 2:] - added[:, :2] <= 30))
+
+            # half-open boxes only touch at their edges, which has no overlapping area
+            overlap = np.clip(np.minimum(added[:, None, 2:], boxes[None, :, 2:]) - np.maximum(added[:, None, :2], boxes[None, :, :2]), 0, None)
+            area = overlap.prod(axis=2)
+            area[np.arange(len(added)), before[frame] + np.arange(len(added))] = 0
+
+            self.assertEqual(area.max(), 0)
+
+        with self.assertRaises(RuntimeError):
+            det.add_disjoint_boxes(5, 'background', 200, 200, min_width=20, max_size=(10, 30))
+
+    def test_occupancy_grid_cell_size(self):
+        random.seed(0)
+        labels = [BoundingBox('f', 'A', (0.1, 0.1), (0.5, 0.5))]
+
+        bba = BoundingBoxArray(labels, max_width=1, max_height=1, cell_size=8)
+        added = bba.add_disjoint_boxes(20, min_width=20, min_height=20, max_size=(100, 100))
+
+        self.assertEqual(bba.array.dtype, np.uint8)
+        self.assertEqual(bba.array.shape, (125, 125))
+        self.assertEqual(len(added), 20)
+
+        for (tlx, tly), (brx, bry) in added:
+            self.assertTrue(0.02 <= brx - tlx <= 0.1 and 0.02 <= bry - tly <= 0.1)
+            self.assertTrue(brx <= 0.1 or tlx >= 0.5 or bry <= 0.1 or tly >= 0.5)
+
+        # 20 rounds up to 3 cells of 8 and down to 2, so no box fits both bounds
+        with self.assertRaises(RuntimeError):
+            bba.add_disjoint_boxes(1, min_width=20, min_height=20, max_size=(20, 20))
+
+    def test_add_disjoint_boxes_reproducible(self):
+        added = []
+
+        for workers in [None, 2]:
+            det = random_detection(num_frames=6, boxes_per_frame=5)
+            det.add_disjoint_boxes(10, 'background', 120, 120, seed=7, workers=workers)
+
+            added.append([(bb.frame_id, bb.tlx, bb.tly, bb.brx, bb.bry) for frame in det.labels for bb in det.labels[frame] if bb.label == 'background'])
+
+        self.assertEqual(len(added[0]), 60)
+        self.assertEqual(added[0], added[1])
+
+    def test_annot_dict_arrays(self):
+        annot_dict = {
+            'f0': {'A': np.array([[0, 0, 10, 10], [5, 5, 2, 3]]), 'B': [(1, 2, 3, 4)]},
+            'f1': {},
+        }
+
+        for columnar in [False, True]:
+            det = Detection(columnar=columnar)
+            det.load_labels_from_annot_dict(annot_dict)
+
+            self.assertEqual(sorted((bb.label, bb.brx, bb.bry) for bb in det.labels['f0']), [('A', 7, 8), ('A', 10, 10), ('B', 4, 6)])
+            self.assertEqual(len(det.labels['f1']), 0)
+
+            arrays = det.labels_to_annot_dict(as_arrays=True)
+            self.assertTrue(np.array_equal(arrays['f0']['A'], annot_dict['f0']['A']))
+            self.assertEqual(arrays['f1'], {})
+            self.assertEqual(det.labels_to_annot_dict()['f0']['B'], [(1, 2, 3, 4)])
+
+    def test_columnar_interleaved_appends(self):
+        rand = random.Random(0)
+        columns = BoundingBoxColumns()
+        expected = dict()
+
+        for step in range(200):
+            bb = BoundingBox(rand.randint(0, 20), 'A', (step, 0), (step + 1, 1))
+            columns.append(bb)
+            expected.setdefault(bb.frame_id, []).append(bb)
+
+            # reading a frame groups the rows, which later appends to earlier frames must preserve
+            frame = rand.randint(0, 20)
+            if frame in expected:
+                self.assertEqual(list(columns[frame]), expected[frame])
+
+        for frame in expected:
+            self.assertEqual(list(columns[frame]), expected[frame])
+
+    def test_columnar_mixed_types(self):
+        labels = [(1, 'A', (0,0), (10,10)), ('x', 'A', (0,0), (10,10)), ('x', 1, (0,0), (10,10))]
+        predictions = [(1, 'A', (0,0), (10,10), 0.9), ('x', '1', (0,0), (10,10), 0.9)]
+
+        det = Detection(labels=labels, predictions=predictions)
+        columnar = Detection(labels=labels, predictions=predictions, columnar=True)
+
+        self.assertEqual(list(columnar.labels), [1, 'x'])
+        self.assertEqual([bb.label for bb in columnar.labels['x']], ['A', 1])
+        self.assertEqual(det.metrics(), columnar.metrics())
+
+    def test_save_load_numpy_ids(self):
+        det = Detection()
+        det.add_labels_array(np.int64(3), np.array([[0, 0, 10, 10]]), np.str_('A'))
+        det.add_predictions_array(np.int64(3), np.array([[0, 0, 10, 10]]), ['A'], [0.9])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            det.save(tmp)
+
+            loaded = Detection()
+            loaded.load(tmp, mmap=True)
+
+            # adding no boxes must not write to the read-only memory maps
+            loaded.add_predictions_array(3, np.empty((0, 4)), [])
+
+            self.assertEqual(list(loaded.labels), [3])
+            self.assertEqual(loaded.metrics(), det.metrics())
+
+    def test_load_labels_only(self):
+        labels = Detection()
+        labels.add_label(BoundingBox(1, 'A', (0,0), (10,10)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            labels.save(tmp)
+
+            det = Detection()
+            det.add_prediction(BoundingBox(5, 'A', (0,0), (10,10), 0.9))
+            det.load(tmp)
+
+            self.assertEqual(list(det.labels), [1])
+            self.assertIsNone(det.predictions)
+
+    def test_save_unserializable(self):
+        det = Detection()
+        det.add_label(BoundingBox(frozenset([1]), 'A', (0,0), (10,10)))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaises(RuntimeError):
+                det.save(os.path.join(tmp, 'saved'))
 
+            self.assertEqual(os.listdir(tmp), [])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,13 +1,83 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
 import os
 import cv2
-import random
+import queue
+import threading
+import zlib
 
 class ImageDeformer():
-    def __init__(self):
-        pass
+    def __init__(self, seed=None, noise_bank_size=0, preserve_dtype=False):
+        """
+            Parameters
+            ----------
+            seed : int or np.random.Generator
+                the seed of the generator behind every random choice and all noise
+            noise_bank_size : int
+                if greater than 0, the number of standard normal values generated up front. 'gauss' and
+                'speckle' noise then read a randomly offset window of the bank instead of drawing new values,
+                trading independence between images for speed
+            preserve_dtype : bool
+                if True, noise is rounded and clipped back into the dtype of the image (like cv2's saturate_cast),
+                so every op returns the dtype it was given instead of float32
+
+            An ImageDeformer reuses its buffers between calls, so use one per thread. Together with the
+            `out` parameter of every op, deforming same-size images allocates no new image-size arrays,
+            except for 'poisson' noise.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.bank = self.rng.standard_normal(noise_bank_size, dtype=np.float32) if noise_bank_size > 0 else None
+        self.preserve_dtype = preserve_dtype
+        self._buffer = np.empty(0, dtype=np.float32)
+        self._scratch = np.empty(0, dtype=np.float32)
 
-    def _apply_noise(self, noise_typ, image):
+    def _standard_normal(self, shape):
+        """
+            Returns float32 standard normal noise of `shape`, either a window of the noise bank or drawn
+            into the reusable buffer. It is only valid until the next call and must not be modified.
+        """
+        size = int(np.prod(shape))
+
+        if self.bank is not None and size <= len(self.bank):
+            start = self.rng.integers(0, len(self.bank) - size + 1)
+            return self.bank[start:start + size].reshape(shape)
+
+        if len(self._buffer) < size:
+            self._buffer = np.empty(size, dtype=np.float32)
+
+        noise = self._buffer[:size].reshape(shape)
+        self.rng.standard_normal(dtype=np.float32, out=noise)
+
+        return noise
+
+    def _float_out(self, shape, out):
+        """
+            Returns the float32 array of `shape` to compute noise into: the reusable scratch buffer if the
+            result is cast back to the image's dtype, else `out` or a new array.
+        """
+        if self.preserve_dtype:
+            size = int(np.prod(shape))
+
+            if len(self._scratch) < size:
+                self._scratch = np.empty(size, dtype=np.float32)
+
+            return self._scratch[:size].reshape(shape)
+
+        return out if out is not None else np.empty(shape, dtype=np.float32)
+
+    def _noise_dtype(self, dtype):
+        """The dtype that 'gauss', 'poisson' and 'speckle' noise of an image of `dtype` returns."""
+        return dtype if self.preserve_dtype else np.dtype(np.float32)
+
+    def _finish(self, noisy, dtype, out):
+        """Returns noise computed into `_float_out`, saturated into `out` or a new array of `dtype` if preserving dtypes."""
+        if self.preserve_dtype:
+            return _saturate(noisy, dtype, out)
+
+        return noisy
+
+    def _apply_noise(self, noise_typ, image, out=None):
         """
         https://stackoverflow.com/a/30609854/7042418
         
@@ -23,47 +93,75 @@ class ImageDeformer():
             's&p'       Replaces random pixels with 0 or 1.
             'speckle'   Multiplicative noise using out = image + n*image,where
                         n is uniform noise with specified mean & variance.
+        out : ndarray
+            Optional array to write the result into.
+        """
+
+        _check_out(out, image.shape, image.dtype if noise_typ == 's&p' else self._noise_dtype(image.dtype))
+
+        if out is not None:
+            self._apply_noise_batch(noise_typ, image[np.newaxis], out[np.newaxis])
+            return out
+
+        return self._apply_noise_batch(noise_typ, image[np.newaxis])[0]
+
+    def _apply_noise_batch(self, noise_typ, images, out=None):
         """
+            `_apply_noise` on a batch of images, generating the noise of the whole batch at once.
+
+            Parameters
+            ----------
+            images : ndarray
+                Input image data of shape (N, H, W, C). Will be converted to float32, except by 's&p'
+                or when preserving dtypes.
+            noise_typ : str
+                see `_apply_noise`
+            out : ndarray
+                Optional array to write the result into.
+        """
+
+        _check_out(out, images.shape, images.dtype if noise_typ == 's&p' else self._noise_dtype(images.dtype))
 
         if noise_typ == "gauss":
-            row,col,ch= image.shape
             mean = 0
             var = 0.1
             sigma = var**0.5
-            gauss = np.random.normal(mean,sigma,(row,col,ch))
-            gauss = gauss.reshape(row,col,ch)
-            noisy = image + gauss
-            return noisy
+            noisy = self._float_out(images.shape, out)
+            np.multiply(self._standard_normal(images.shape), sigma, out=noisy)
+            noisy += mean
+            noisy += images
+            return self._finish(noisy, images.dtype, out)
         elif noise_typ == "s&p":
-            row,col,ch = image.shape
             s_vs_p = 0.5
             amount = 0.004
-            out = np.copy(image)
+            out = np.empty_like(images) if out is None else out
+            np.copyto(out, images)
             # Salt mode
-            num_salt = np.ceil(amount * image.size * s_vs_p)
-            coords = [np.random.randint(0, i - 1, int(num_salt))
-                    for i in image.shape]
+            num_salt = np.ceil(amount * images[0].size * s_vs_p) * len(images)
+            coords = tuple(self.rng.integers(0, i, int(num_salt))
+                    for i in images.shape)
             out[coords] = 1
 
             # Pepper mode
-            num_pepper = np.ceil(amount* image.size * (1. - s_vs_p))
-            coords = [np.random.randint(0, i - 1, int(num_pepper))
-                    for i in image.shape]
+            num_pepper = np.ceil(amount * images[0].size * (1. - s_vs_p)) * len(images)
+            coords = tuple(self.rng.integers(0, i, int(num_pepper))
+                    for i in images.shape)
             out[coords] = 0
             return out
         elif noise_typ == "poisson":
-            vals = len(np.unique(image))
-            vals = 2 ** np.ceil(np.log2(vals))
-            noisy = np.random.poisson(image * vals) / float(vals)
-            return noisy
+            # the number of distinct values is a property of each image
+            vals = np.array([_num_values(image) for image in images])
+            vals = 2 ** np.ceil(np.log2(vals)).reshape(-1, 1, 1, 1)
+            noisy = self._float_out(images.shape, out)
+            np.divide(self.rng.poisson(images * vals), vals, out=noisy)
+            return self._finish(noisy, images.dtype, out)
         elif noise_typ =="speckle":
-            row,col,ch = image.shape
-            gauss = np.random.randn(row,col,ch)
-            gauss = gauss.reshape(row,col,ch)        
-            noisy = image + image * gauss
-            return noisy
+            noisy = self._float_out(images.shape, out)
+            np.multiply(images, self._standard_normal(images.shape), out=noisy)
+            noisy += images
+            return self._finish(noisy, images.dtype, out)
 
-    def noise(self, image):
+    def noise(self, image, out=None):
         """
             Applys noise to this image and then
             returns a copy of the image with the noise
@@ -73,10 +171,12 @@ class ImageDeformer():
             ----------
             image : ndarray
                 Input image data. Will be converted to float.
+            out : ndarray
+                Optional array to write the result into.
         """
-        return self._apply_noise('speckle', image)
+        return self._apply_noise('speckle', image, out)
 
-    def gaussian_blur(self, image, blur_amount=33):
+    def gaussian_blur(self, image, blur_amount=33, out=None):
         """
             Applys gaussian blur to this image and then
             returns a copy of the image with the blur
@@ -86,10 +186,14 @@ class ImageDeformer():
             ----------
             image : ndarray
                 Input image data. Will be converted to float.
+            out : ndarray
+                Optional array of the image's shape and dtype to write the result into.
         """
-        return cv2.GaussianBlur(image, (blur_amount,blur_amount),0)
+        _check_out(out, image.shape, image.dtype)
+
+        return _into(cv2.GaussianBlur(image, (blur_amount,blur_amount),0, dst=out), out)
 
-    def median_blur(self, image, blur_amount=13):
+    def median_blur(self, image, blur_amount=13, out=None):
         """
             Applys median blur to this image and then
             returns a copy of the image with the blur
@@ -99,10 +203,14 @@ class ImageDeformer():
             ----------
             image : ndarray
                 Input image data. Will be converted to float.
+            out : ndarray
+                Optional array of the image's shape and dtype to write the result into.
         """
-        return cv2.medianBlur(image, blur_amount)
+        _check_out(out, image.shape, image.dtype)
 
-    def pixelate(self, image):
+        return _into(cv2.medianBlur(image, blur_amount, dst=out), out)
+
+    def pixelate(self, image, out=None):
         """
             Scales down and then scales up this image to its
             original size to produce a lower quality, more
@@ -112,11 +220,15 @@ class ImageDeformer():
             ----------
             image : ndarray
                 Input image data. Will be converted to float.
+            out : ndarray
+                Optional array of the image's shape and dtype to write the result into.
         """
-        w,h,_ = image.shape
-        return cv2.resize(cv2.resize(image, (32,32)), (w,h))
+        _check_out(out, image.shape, image.dtype)
+
+        h,w,_ = image.shape
+        return _into(cv2.resize(cv2.resize(image, (32,32)), (w,h), dst=out), out)
 
-    def random_deform(self, image):
+    def random_deform(self, image, out=None):
         """
             Randomly applies a deformity to this image and returns a copy of the image with the deformity
             applied.
@@ -125,39 +237,300 @@ class ImageDeformer():
             ----------
             image : ndarray
                 Input image data. Will be converted to float.
+            out : ndarray
+                Optional array of the image's shape and dtype to write the result into. Noise only keeps
+                the dtype of the image if preserving dtypes, so otherwise the image must be float32.
         """
+        self._check_deform_out(out, image.shape, image.dtype)
 
-        choice = random.randint(0, 3)
+        choice = self.rng.integers(0, 4)
         options = [self.gaussian_blur, self.noise, self.median_blur, self.pixelate]
 
-        return options[choice](image)
+        return options[choice](image, out=out)
+
+    def _check_deform_out(self, out, shape, dtype):
+        """Raises unless every deformity can write an image of `shape` and `dtype` into `out`."""
+        if out is not None and self._noise_dtype(dtype) != dtype:
+            raise RuntimeError('Noise turns {} images into float32, so random deformities can only be written into out with preserve_dtype=True!'.format(dtype))
+
+        _check_out(out, shape, dtype)
+
+    def noise_batch(self, images, out=None):
+        """
+            `noise` on a batch of images of shape (N, H, W, C).
+        """
+        return self._apply_noise_batch('speckle', images, out)
+
+    def gaussian_blur_batch(self, images, blur_amount=33, out=None):
+        """
+            `gaussian_blur` on a batch of images of shape (N, H, W, C).
+        """
+        return _map_images(lambda image, out: self.gaussian_blur(image, blur_amount, out), images, out)
+
+    def median_blur_batch(self, images, blur_amount=13, out=None):
+        """
+            `median_blur` on a batch of images of shape (N, H, W, C).
+        """
+        return _map_images(lambda image, out: self.median_blur(image, blur_amount, out), images, out)
+
+    def pixelate_batch(self, images, out=None):
+        """
+            `pixelate` on a batch of images of shape (N, H, W, C).
+        """
+        return _map_images(self.pixelate, images, out)
+
+    def random_deform_batch(self, images, out=None):
+        """
+            `random_deform` on a batch of images of shape (N, H, W, C). The images given the same
+            deformity are deformed together by its batch method.
+
+            The result has the dtype of the deformed images, which is float if any image was given noise
+            and dtypes are not preserved. If `out` is given, each image is deformed directly into it instead,
+            see `random_deform`.
+        """
+        self._check_deform_out(out, images.shape, images.dtype)
+
+        choices = self.rng.integers(0, 4, len(images))
+        options = [self.gaussian_blur_batch, self.noise_batch, self.median_blur_batch, self.pixelate_batch]
 
-def deform_directory(in_dir, out_dir, label_dir=1,):
+        if out is not None:
+            singles = [self.gaussian_blur, self.noise, self.median_blur, self.pixelate]
+
+            for i,choice in enumerate(choices):
+                singles[choice](images[i], out=out[i])
+
+            return out
+
+        groups = [(np.flatnonzero(choices == choice), option) for choice,option in enumerate(options)]
+        results = [(index, option(images[index])) for index,option in groups if len(index) > 0]
+
+        out = np.empty(images.shape, dtype=np.result_type(images, *[result for _,result in results]))
+
+        for index,result in results:
+            out[index] = result
+
+        return out
+
+def _saturate(values, dtype, out=None):
+    """Rounds and clips the float array `values` in place into the range of `dtype`, and writes it into `out` or a new array."""
+    if out is None:
+        out = np.empty(values.shape, dtype=dtype)
+
+    if np.dtype(dtype).kind in 'iu':
+        info = np.iinfo(dtype)
+        np.rint(values, out=values)
+        np.clip(values, info.min, info.max, out=values)
+
+    np.copyto(out, values, casting='unsafe')
+
+    return out
+
+def _check_out(out, shape, dtype):
+    """Raises unless `out` is None or an array of `shape` and `dtype`, since cv2 silently allocates a new array otherwise."""
+    if out is not None and (out.shape != tuple(shape) or out.dtype != dtype):
+        raise RuntimeError('out has shape {} and dtype {}, but the result has shape {} and dtype {}!'.format(out.shape, out.dtype, tuple(shape), np.dtype(dtype)))
+
+def _into(result, out):
+    """Returns `result`, copied into `out` first if given and cv2 wrote it elsewhere."""
+    if out is None or result is out:
+        return result
+
+    np.copyto(out, result)
+
+    return out
+
+def _map_images(func, images, out=None):
     """
-        TODO
+        Applies `func(image, out)` to each image of a batch of shape (N, H, W, C), writing into one output array.
+        cv2 filters are already multi-threaded within an image, so one call per image is cheaper than
+        stacking the batch into one padded image.
     """
+    # every mapped op keeps the shape and dtype of the images
+    _check_out(out, images.shape, images.dtype)
 
-    imdef = ImageDeformer()
+    for i,image in enumerate(images):
+        if out is None:
+            result = func(image, None)
+            out = np.empty((len(images),) + result.shape, dtype=result.dtype)
+            out[i] = result
+        else:
+            func(image, out[i])
 
-    # make the deformed directory
-    try:
-        os.mkdir(out_dir)
-    except:
-        pass
+    return out if out is not None else np.empty_like(images)
+
+def deform_directory(in_dir, out_dir, label_dir=1, workers=None, seed=None, chunksize=16, io_threads=0, queue_size=32):
+    """
+        Randomly deforms every .jpg under `in_dir` and writes it to `out_dir`/<fold>/<name>, where
+        <fold> is item `label_dir` of the image's directory path split on '/'.
+
+        Parameters
+        ----------
+        workers : int
+            if greater than 1, images are decoded, deformed and encoded across a pool of `workers` processes,
+            which are sent file paths only
+        seed : int
+            if given, each image is deformed with generators seeded from `seed` and its path, so the output
+            is reproducible and independent of the number of workers
+        chunksize : int
+            the number of images sent to a worker at a time
+        io_threads : int
+            if greater than 0, each process runs a pipeline of `io_threads` reader threads that prefetch and
+            decode images, deforms them, and hands them to `io_threads` writer threads to encode, so that
+            disk and network latency overlap with deforming
+        queue_size : int
+            the most decoded or deformed images waiting between pipeline stages, which bounds memory
+    """
+
+    jobs = []
 
     for root, dirs, files in os.walk(in_dir, topdown=False):
         for name in files:
             if name[-4:] == '.jpg': # is an image
-                def_im = imdef.random_deform(cv2.imread(os.path.join(root, name)))
-
                 fold = root.split('/')[label_dir]
+                path = os.path.join(root, name)
+
+                jobs.append((path, '{}/{}/{}'.format(out_dir,fold,name), _image_seed(seed, os.path.relpath(path, in_dir))))
+
+    # make the deformed directories up front, so workers never race to create them
+    for fold in sorted(set(os.path.dirname(job[1]) for job in jobs)) or [out_dir]:
+        os.makedirs(fold, exist_ok=True)
+
+    if workers is not None and workers > 1:
+        chunks = [jobs[i:i + chunksize] for i in range(0, len(jobs), chunksize)]
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            for _ in pool.map(_deform_files, chunks, repeat(io_threads), repeat(queue_size)):
+                pass
+    else:
+        _deform_files(jobs, io_threads, queue_size)
+
+def _num_values(image):
+    """Returns the number of distinct values in `image`, counting rather than sorting for 8 and 16 bit images."""
+    if image.dtype.kind == 'u' and image.dtype.itemsize <= 2:
+        return np.count_nonzero(np.bincount(image.ravel(), minlength=1))
+
+    return len(np.unique(image))
 
+def _image_seed(seed, path):
+    """Returns the seed of one image derived from a master `seed`, which is stable across processes and runs, or None."""
+    if seed is None:
+        return None
+
+    return zlib.crc32('{}/{}'.format(seed, path).encode())
+
+def _init_worker():
+    """Gives each worker process one cv2 thread, since the pool provides the parallelism."""
+    cv2.setNumThreads(1)
+
+def _deform_image(job, image):
+    """Randomly deforms the decoded image of a `deform_directory` job."""
+    in_path, out_path, seed = job
+
+    # saturating like cv2.imwrite would, without the float round trip
+    return ImageDeformer(seed, preserve_dtype=True).random_deform(image)
+
+def _deform_files(jobs, io_threads=0, queue_size=32):
+    """Reads, randomly deforms and writes the images of `deform_directory` jobs, see `_pipeline`."""
+    if io_threads > 0:
+        _pipeline(jobs, io_threads, queue_size)
+        return
+
+    for job in jobs:
+        cv2.imwrite(job[1], _deform_image(job, cv2.imread(job[0])))
+
+def _pipeline(jobs, io_threads, queue_size):
+    """
+        Deforms `jobs` with reader threads decoding into one bounded queue, this thread deforming
+        into another, and writer threads encoding from it. cv2 releases the GIL while decoding and encoding.
+        Each image is deformed with its own generator, so the output does not depend on the order images are decoded in.
+    """
+    pending = queue.Queue()
+    decoded = queue.Queue(maxsize=queue_size)
+    deformed = queue.Queue(maxsize=queue_size)
+
+    for job in jobs:
+        pending.put(job)
+
+    stop = threading.Event()
+    errors = []
+
+    def put(q, item):
+        # gives up once another stage has failed, so no thread blocks forever on a full queue
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+        return None
+
+    def read():
+        try:
+            while not stop.is_set():
                 try:
-                    os.mkdir('{}/{}'.format(out_dir,fold))
-                except:
-                    pass
+                    job = pending.get_nowait()
+                except queue.Empty:
+                    break
+
+                put(decoded, (job, cv2.imread(job[0])))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(decoded, None)
+
+    def write():
+        try:
+            while True:
+                item = get(deformed)
+
+                if item is None: break
+
+                cv2.imwrite(*item)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    readers = [threading.Thread(target=read, daemon=True) for _ in range(io_threads)]
+    writers = [threading.Thread(target=write, daemon=True) for _ in range(io_threads)]
+
+    for thread in readers + writers:
+        thread.start()
+
+    try:
+        finished = 0
+
+        while finished < len(readers):
+            item = get(decoded)
+
+            if item is None:
+                if stop.is_set(): break
+
+                finished += 1
+                continue
+
+            job, image = item
+            put(deformed, (job[1], _deform_image(job, image)))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for _ in writers:
+            put(deformed, None)
+
+        for thread in readers + writers:
+            thread.join()
 
-                cv2.imwrite('{}/{}/{}'.format(out_dir,fold,name), def_im)
+    if len(errors) > 0:
+        raise errors[0]
 
 if __name__ == "__main__":
     # imdef = ImageDeformer()
@@ -0,0 +1,144 @@
+import unittest
+from unittest import mock
+import os
+import tempfile
+import threading
+import numpy as np
+import cv2
+
+from deformer import ImageDeformer, deform_directory
+
+def random_images(num_images=6, height=40, width=50, seed=0):
+    """Returns a (num_images, height, width, 3) uint8 batch of random images."""
+    return np.random.default_rng(seed).integers(0, 256, (num_images, height, width, 3), dtype=np.uint8)
+
+def write_images(in_dir, num_folds=2, images_per_fold=5):
+    """Writes random jpgs to `in_dir`/fold_<i>/<j>.jpg."""
+    for i in range(num_folds):
+        os.makedirs(os.path.join(in_dir, 'fold_{}'.format(i)))
+
+        for j,image in enumerate(random_images(images_per_fold, seed=i)):
+            cv2.imwrite(os.path.join(in_dir, 'fold_{}'.format(i), '{}.jpg'.format(j)), image)
+
+def read_outputs(out_dir):
+    """Returns a dict of path relative to `out_dir` -> bytes of every file under it."""
+    outputs = dict()
+
+    for root, dirs, files in os.walk(out_dir):
+        for name in files:
+            with open(os.path.join(root, name), 'rb') as f:
+                outputs[os.path.relpath(os.path.join(root, name), out_dir)] = f.read()
+
+    return outputs
+
+class TestImageDeformer(unittest.TestCase):
+
+    def test_batch_matches_single(self):
+        images = random_images()
+
+        for preserve_dtype in [False, True]:
+            for name in ['noise', 'gaussian_blur', 'median_blur', 'pixelate']:
+                batch = getattr(ImageDeformer(1, preserve_dtype=preserve_dtype), name + '_batch')(images)
+
+                single = ImageDeformer(1, preserve_dtype=preserve_dtype)
+                expected = np.stack([getattr(single, name)(image) for image in images])
+
+                self.assertEqual(batch.dtype, expected.dtype)
+                np.testing.assert_array_equal(batch, expected)
+
+    def test_random_deform_batch_matches_single(self):
+        images = random_images(12)
+
+        # with out, each image is deformed on its own rather than with the others given the same deformity
+        grouped = ImageDeformer(1, preserve_dtype=True).random_deform_batch(images)
+        out = np.zeros_like(images)
+        single = ImageDeformer(1, preserve_dtype=True).random_deform_batch(images, out=out)
+
+        self.assertIs(single, out)
+        np.testing.assert_array_equal(grouped, out)
+
+    def test_out_is_filled(self):
+        images = random_images()
+        batch_deformer = ImageDeformer(1, preserve_dtype=True)
+
+        for name in ['noise', 'gaussian_blur', 'median_blur', 'pixelate', 'random_deform']:
+            expected = getattr(ImageDeformer(1, preserve_dtype=True), name)(images[0])
+            out = np.zeros_like(images[0])
+            result = getattr(ImageDeformer(1, preserve_dtype=True), name)(images[0], out=out)
+
+            self.assertIs(result, out)
+            self.assertEqual(out.dtype, np.uint8)
+            np.testing.assert_array_equal(out, expected)
+
+            out = np.zeros_like(images)
+            result = getattr(batch_deformer, name + '_batch')(images, out=out)
+
+            self.assertIs(result, out)
+            self.assertEqual(out.dtype, np.uint8)
+
+    def test_out_mismatch(self):
+        images = random_images()
+
+        with self.assertRaises(RuntimeError):
+            ImageDeformer(1).gaussian_blur(images[0], out=np.empty(images[0].shape, dtype=np.float32))
+
+        with self.assertRaises(RuntimeError):
+            ImageDeformer(1).median_blur_batch(images, out=np.empty_like(images[1:]))
+
+        # noise is float32 unless preserving dtypes
+        with self.assertRaises(RuntimeError):
+            ImageDeformer(1).noise(images[0], out=np.empty_like(images[0]))
+
+        with self.assertRaises(RuntimeError):
+            ImageDeformer(1).random_deform_batch(images, out=np.empty_like(images))
+
+        out = np.empty(images[0].shape, dtype=np.float32)
+        self.assertIs(ImageDeformer(1).noise(images[0], out=out), out)
+
+class TestDeformDirectory(unittest.TestCase):
+
+    def test_reproducible(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            in_dir = os.path.join(tmp, 'data')
+            write_images(in_dir)
+
+            outputs = []
+
+            for workers,io_threads in [(None, 0), (2, 0), (None, 2), (2, 2)]:
+                out_dir = os.path.join(tmp, 'deformed_{}_{}'.format(workers, io_threads))
+                deform_directory(in_dir, out_dir, label_dir=len(in_dir.split('/')), workers=workers, seed=3,
+                    chunksize=3, io_threads=io_threads, queue_size=2)
+
+                outputs.append(read_outputs(out_dir))
+
+        self.assertEqual(sorted(outputs[0]), ['fold_{}/{}.jpg'.format(i, j) for i in range(2) for j in range(5)])
+
+        for output in outputs[1:]:
+            self.assertEqual(output, outputs[0])
+
+    def test_pipeline_raises(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            in_dir = os.path.join(tmp, 'data')
+            write_images(in_dir, images_per_fold=20)
+
+            def run(errors):
+                try:
+                    deform_directory(in_dir, os.path.join(tmp, 'deformed'), label_dir=len(in_dir.split('/')), seed=3,
+                        io_threads=2, queue_size=1)
+                except Exception as e:
+                    errors.append(e)
+
+            # a failure in any stage stops the others, rather than leaving them blocked on a full or empty queue
+            for target in ['deformer._deform_image', 'deformer.cv2.imread', 'deformer.cv2.imwrite']:
+                errors = []
+
+                with mock.patch(target, side_effect=ValueError(target)):
+                    thread = threading.Thread(target=run, args=(errors,), daemon=True)
+                    thread.start()
+                    thread.join(timeout=30)
+
+                self.assertFalse(thread.is_alive())
+                self.assertEqual([str(e) for e in errors], [target])
+
+if __name__ == '__main__':
+    unittest.main()